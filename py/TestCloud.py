@@ -1,43 +1,27 @@
-import colorsys
+import argparse
 import logging
 from collections import Counter
-import re 
-import matplotlib.pyplot as plt
-import numpy as np
-from wordcloud import WordCloud
-from parsers.universal import parse
-
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+import instrument
+from cloud_render import RENDER_PARAMS, build_word_cloud, render_params, render_word_clouds
+from parsers.universal import parse_stream
+from parsers.tokenization import tokenize, tokenize_many
+
 logger = logging.getLogger(__name__)
 
 
 def clean_and_tokenize(message):
-    message = message.lower()
-    message = re.sub(r'[^a-z0-9\s]', '', message)
-    return message.split()
-
-def generate_soft_color_func(saturation=0.3, value=0.9):
-    def color_func(word, font_size, position, orientation, random_state=None, **kwargs):
-        hue = np.random.uniform(0, 1)
-        r, g, b = colorsys.hsv_to_rgb(hue, saturation, value)
-        return f"rgb({int(r*255)}, {int(g*255)}, {int(b*255)})"
-    return color_func
-
-def create_word_cloud(word_ratios, title, size_ratio=1.5):
+    return tokenize(message)
+
+def create_word_cloud(word_ratios, title, **overrides):
     if not word_ratios:
         logger.warning(f"No words to create word cloud for {title}")
         return
-    
+
+    import matplotlib.pyplot as plt
+
     logger.info(f"Creating word cloud for {title}")
-    adjusted_ratios = {word: (ratio ** size_ratio) for word, ratio in word_ratios.items()}
-    
-    wordcloud = WordCloud(width=800, height=400, 
-                          background_color='white', 
-                          color_func=generate_soft_color_func(),
-                          min_font_size=10,
-                          max_font_size=100).generate_from_frequencies(adjusted_ratios)
-    
+    wordcloud = build_word_cloud(word_ratios, render_params(**overrides))
+
     plt.figure(figsize=(10, 5))
     plt.imshow(wordcloud, interpolation='bilinear')
     plt.axis('off')
@@ -46,43 +30,59 @@ def create_word_cloud(word_ratios, title, size_ratio=1.5):
     plt.show()
 
 
-file_path = 'files/mini_hangouts.txt'
-user_messages = parse(open(file_path).read())
-users = set([i.user for i in user_messages])
+def main(file_path='files/mini_hangouts.txt', output_format=None):
+    # output_format "png" or "svg" writes images into CLOUD_CACHE_DIR instead of opening windows
+    from word_scores import UserWordCounts
+
+    with instrument.span("TestCloud.parse"):
+        user_messages = list(parse_stream(file_path))
+    users = set([i.user for i in user_messages])
+
+    if not user_messages:
+        logger.error("Failed to parse the chat. Please check the logs above for more details.")
+        return None
 
-if user_messages:
     total_messages = len(user_messages)
     logger.info(f"\nTotal number of messages: {total_messages}")
 
-    user_word_counts = {user: Counter() for user in users}
-    total_word_counts = {user: 0 for user in users}
-
-    for message in user_messages:
-        words = clean_and_tokenize(message.message)
-        user = message.user
-        user_word_counts[user].update(words)
-        total_word_counts[user] += len(words)
+    message_counts = Counter(message.user for message in user_messages)
+    with instrument.span("TestCloud.tokenize"):
+        message_tokens = tokenize_many(message.message for message in user_messages)
+    instrument.count("tokens", sum(map(len, message_tokens)))
+    with instrument.span("TestCloud.count_words"):
+        word_counts = UserWordCounts.from_tokens(zip((message.user for message in user_messages), message_tokens))
+    total_word_counts = dict(zip(word_counts.users, word_counts.user_totals().tolist()))
+    unique_word_counts = dict(zip(word_counts.users, word_counts.counts.getnnz(axis=1).tolist()))
 
     logger.info("\nPer-user statistics:")
     for user in users:
         logger.info(f"  {user}:")
-        logger.info(f"    Messages: {len([m for m in user_messages if m.user == user])}")
+        logger.info(f"    Messages: {message_counts[user]}")
         logger.info(f"    Total words: {total_word_counts[user]}")
-        logger.info(f"    Unique words: {len(user_word_counts[user])}")
+        logger.info(f"    Unique words: {unique_word_counts[user]}")
 
-    word_ratios = {}
-    for user in users:
-        word_ratios[user] = {}
-        for word in user_word_counts[user]:
-            user_count = user_word_counts[user][word]
-            other_users_count = sum(user_word_counts[other_user][word] for other_user in users if other_user != user)
-            ratio = (user_count + 1) / (other_users_count + 1)
-            word_ratios[user][word] = ratio
+    with instrument.span("TestCloud.word_ratios"):
+        word_ratios = word_counts.top_k(word_counts.ratios(), RENDER_PARAMS["max_words"])
 
     logger.info("\nGenerating word clouds...")
-    for user in users:
-        create_word_cloud(word_ratios[user], f"Word Cloud for {user}")
+    if output_format:
+        with instrument.span("TestCloud.render"):
+            rendered = render_word_clouds(word_ratios, output_format)
+        for user, path in rendered.items():
+            logger.info(f"  Word Cloud for {user}: {path}")
+    else:
+        rendered = None
+        for user in users:
+            create_word_cloud(word_ratios[user], f"Word Cloud for {user}")
 
     logger.info("Script execution completed")
-else:
-    logger.error("Failed to parse the chat. Please check the logs above for more details.")
\ No newline at end of file
+    return rendered
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Per-user word clouds of the words each person uses most distinctively")
+    arg_parser.add_argument("chat_file", nargs="?", default='files/mini_hangouts.txt')
+    arg_parser.add_argument("--format", choices=["png", "svg"], default=None, help="write images instead of showing them")
+    args = arg_parser.parse_args()
+    main(args.chat_file, args.format)
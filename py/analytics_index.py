@@ -0,0 +1,213 @@
+import argparse
+import json
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from parsers.store import MessageStore, from_epoch, parse_columnar, to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Precomputed per-user aggregates for chart backends. Message and word counts
+# are kept per hour, response-latency histograms per day, each as a cumulative
+# sum over time with a leading zero row. Any time range is then two row lookups
+# and a subtraction, and days or weeks are cut out of the hourly sums at their
+# boundaries instead of being recomputed from messages.
+
+INDEX_VERSION = 1
+HOUR = 3600
+DAY = 24 * HOUR
+# 1970-01-01 was a Thursday (weekday 3)
+EPOCH_WEEKDAY = 3
+# Upper edges, in seconds, of the reply-latency bins: 1m, 5m, 15m, 1h, 3h, 6h, 12h, 1d, 3d, 1w, longer
+LATENCY_EDGES = np.array([60, 300, 900, HOUR, 3 * HOUR, 6 * HOUR, 12 * HOUR, DAY, 3 * DAY, 7 * DAY], dtype=np.int64)
+
+
+def _epoch(value):
+    return to_epoch(value) if isinstance(value, datetime) else value
+
+
+def week_starts(epochs, week_start=6):
+    # Epoch second of the start of each timestamp's week; week_start uses Python
+    # weekday numbers, and 6 (Sunday) matches date-fns startOfWeek
+    days = np.asarray(epochs, dtype=np.int64) // DAY
+    return (days - (days + EPOCH_WEEKDAY - week_start) % 7) * DAY
+
+
+def _cumulative(counts):
+    # Leading zero row, so cumulative[j] - cumulative[i] sums rows i..j-1
+    cumulative = np.zeros((counts.shape[0] + 1,) + counts.shape[1:], dtype=np.int64)
+    np.cumsum(counts, axis=0, out=cumulative[1:])
+    return cumulative
+
+
+def _binned(keys, minlength, weights=None):
+    return np.bincount(keys, weights=weights, minlength=minlength)[:minlength].astype(np.int64)
+
+
+class AnalyticsIndex:
+    def __init__(self, users, origin, messages, words, latency_origin, latencies):
+        self.users = users
+        # Epoch second of the first hour row, and of the first latency (day) row
+        self.origin = origin
+        self.latency_origin = latency_origin
+        # Cumulative (hours + 1, users) message and word counts
+        self.messages = messages
+        self.words = words
+        # Cumulative (days + 1, users, len(LATENCY_EDGES) + 1) reply-latency counts
+        self.latencies = latencies
+
+    @classmethod
+    def build(cls, store):
+        user_count = len(store.users)
+        if not len(store):
+            empty = np.zeros((1, user_count), dtype=np.int64)
+            return cls(list(store.users), 0, empty, empty.copy(), 0,
+                       np.zeros((1, user_count, len(LATENCY_EDGES) + 1), dtype=np.int64))
+
+        timestamps = store.timestamps
+        user_ids = store.user_ids.astype(np.int64)
+        word_counts = store.word_counts()
+        if not store.is_sorted:
+            order = np.argsort(timestamps, kind="stable")
+            timestamps, user_ids, word_counts = timestamps[order], user_ids[order], word_counts[order]
+
+        origin = int(timestamps[0]) // HOUR * HOUR
+        hours = (timestamps - origin) // HOUR
+        hour_count = int(hours[-1]) + 1
+        keys = hours * user_count + user_ids
+        messages = _binned(keys, hour_count * user_count).reshape(hour_count, user_count)
+        words = _binned(keys, hour_count * user_count, word_counts).reshape(hour_count, user_count)
+
+        # A reply is a message from someone other than the previous sender; its
+        # latency counts for the person replying, on the day they replied
+        latency_origin = origin // DAY * DAY
+        day_count = int((timestamps[-1] - latency_origin) // DAY) + 1
+        bin_count = len(LATENCY_EDGES) + 1
+        replies = np.flatnonzero(user_ids[1:] != user_ids[:-1]) + 1
+        gaps = timestamps[replies] - timestamps[replies - 1]
+        bins = np.searchsorted(LATENCY_EDGES, gaps, side="left")
+        days = (timestamps[replies] - latency_origin) // DAY
+        latency_keys = (days * user_count + user_ids[replies]) * bin_count + bins
+        latencies = _binned(latency_keys, day_count * user_count * bin_count).reshape(day_count, user_count, bin_count)
+
+        return cls(list(store.users), origin, _cumulative(messages), _cumulative(words), latency_origin, _cumulative(latencies))
+
+    @classmethod
+    def from_messages(cls, messages):
+        # messages as returned by universal.parse
+        return cls.build(MessageStore.from_messages(messages))
+
+    def save(self, path):
+        np.savez_compressed(
+            path,
+            version=INDEX_VERSION,
+            users=np.array(self.users, dtype=str),
+            origin=self.origin,
+            messages=self.messages,
+            words=self.words,
+            latency_origin=self.latency_origin,
+            latencies=self.latencies,
+        )
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError(f"{path} is index version {int(data['version'])}, expected {INDEX_VERSION}")
+            return cls(data["users"].tolist(), int(data["origin"]), data["messages"], data["words"],
+                       int(data["latency_origin"]), data["latencies"])
+
+    @property
+    def start(self):
+        return from_epoch(self.origin)
+
+    @property
+    def end(self):
+        return from_epoch(self.origin + (len(self.messages) - 1) * HOUR)
+
+    def _rows(self, bounds, origin, resolution, row_count):
+        # Row indices for epoch bounds, clipped to the index; bounds round down to the row
+        return np.clip((np.asarray(bounds, dtype=np.int64) - origin) // resolution, 0, row_count - 1)
+
+    def _range(self, cumulative, origin, resolution, start, end):
+        row_count = len(cumulative)
+        lo = 0 if start is None else int(self._rows(_epoch(start), origin, resolution, row_count))
+        hi = row_count - 1 if end is None else int(self._rows(_epoch(end), origin, resolution, row_count))
+        return cumulative[max(hi, lo)] - cumulative[lo]
+
+    def totals(self, start=None, end=None):
+        # {user: {"messages": n, "words": n}} for start <= date < end, whole hours
+        messages = self._range(self.messages, self.origin, HOUR, start, end).tolist()
+        words = self._range(self.words, self.origin, HOUR, start, end).tolist()
+        return {user: {"messages": m, "words": w} for user, m, w in zip(self.users, messages, words)}
+
+    def bucket_starts(self, unit="day", start=None, end=None, week_start=6):
+        # Epoch seconds at which each hour/day/week bucket overlapping the index begins
+        start = self.origin if start is None else _epoch(start)
+        end = self.origin + (len(self.messages) - 1) * HOUR if end is None else _epoch(end)
+        if unit == "hour":
+            first, step = start // HOUR * HOUR, HOUR
+        elif unit == "day":
+            first, step = start // DAY * DAY, DAY
+        elif unit == "week":
+            first, step = int(week_starts(start, week_start)), 7 * DAY
+        else:
+            raise ValueError(f"Unknown unit {unit!r}, expected hour, day or week")
+        return np.arange(first, max(end, first + 1), step, dtype=np.int64)
+
+    def series(self, unit="day", start=None, end=None, week_start=6):
+        # (bucket start epochs, messages[bucket, user], words[bucket, user]), re-bucketed from the hourly sums
+        starts = self.bucket_starts(unit, start, end, week_start)
+        step = int(starts[1] - starts[0]) if len(starts) > 1 else {"hour": HOUR, "day": DAY, "week": 7 * DAY}[unit]
+        # Bounds outside the index clip to its first or last row, so those buckets come out empty
+        rows = self._rows(np.append(starts, starts[-1] + step), self.origin, HOUR, len(self.messages))
+        return starts, np.diff(self.messages[rows], axis=0), np.diff(self.words[rows], axis=0)
+
+    def hour_of_day(self, start=None, end=None):
+        # Messages per (hour of day, user) over the range
+        row_count = len(self.messages)
+        lo = 0 if start is None else int(self._rows(_epoch(start), self.origin, HOUR, row_count))
+        hi = row_count - 1 if end is None else int(self._rows(_epoch(end), self.origin, HOUR, row_count))
+        hourly = np.diff(self.messages[lo:max(hi, lo) + 1], axis=0)
+        hours = (self.origin // HOUR + lo + np.arange(len(hourly))) % 24
+        result = np.zeros((24, len(self.users)), dtype=np.int64)
+        np.add.at(result, hours, hourly)
+        return result
+
+    def latency_histogram(self, start=None, end=None):
+        # Reply counts per (user, latency bin) over the range, whole days
+        return self._range(self.latencies, self.latency_origin, DAY, start, end)
+
+    def chart_series(self, unit="week", start=None, end=None, metric="words"):
+        # Rows shaped like the frontend's weekly chart data: {"weekStart": "yyyy-MM-dd", user: value, ...}
+        starts, messages, words = self.series(unit, start, end)
+        values = (words if metric == "words" else messages).tolist()
+        key = f"{unit}Start"
+        return [
+            {key: from_epoch(int(bucket)).strftime("%Y-%m-%d" if unit != "hour" else "%Y-%m-%dT%H:00"), **dict(zip(self.users, row))}
+            for bucket, row in zip(starts.tolist(), values)
+        ]
+
+
+def build_index(chat_file, index_path, pattern=None):
+    store = parse_columnar(chat_file, pattern)
+    index = AnalyticsIndex.build(store)
+    index.save(index_path)
+    logger.info(f"Indexed {len(store)} messages from {len(index.users)} users, {len(index.messages) - 1} hours, into {index_path}")
+    return index
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Build a time-bucketed analytics index from a chat export")
+    arg_parser.add_argument("chat_file")
+    arg_parser.add_argument("index", help="output .npz")
+    arg_parser.add_argument("--chart-json", default=None, help="also write weekly word counts for the frontend")
+    args = arg_parser.parse_args()
+
+    index = build_index(args.chat_file, args.index)
+    if args.chart_json:
+        with open(args.chart_json, "w", encoding="utf-8") as f:
+            json.dump(index.chart_series("week"), f, ensure_ascii=False)
@@ -0,0 +1,36 @@
+import argparse
+import re
+import subprocess
+import sys
+
+# Cold import time of the entry modules, from `python -X importtime` in fresh
+# interpreters (best of --runs). Exits non-zero when the parsing module goes
+# over --budget-ms, so it can gate CI.
+#
+# Run from py/: python -m benchmarks.bench_import
+
+MODULES = ["parsers.universal", "parsers.tokenization", "cli", "personality", "TestCloud", "cloud_render"]
+BUDGETED = "parsers.universal"
+
+
+def import_time_ms(module):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, check=True)
+    # Cumulative microseconds on the line for the module itself
+    match = re.search(rf"^import time:\s+\d+ \|\s+(\d+) \| {re.escape(module)}$", result.stderr, re.MULTILINE)
+    return int(match.group(1)) / 1000
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Import time of the entry modules")
+    arg_parser.add_argument("--runs", type=int, default=5)
+    arg_parser.add_argument("--budget-ms", type=float, default=50.0, help=f"limit for {BUDGETED}")
+    args = arg_parser.parse_args()
+
+    timings = {module: min(import_time_ms(module) for _ in range(args.runs)) for module in MODULES}
+    for module, milliseconds in timings.items():
+        print(f"{module:<22} {milliseconds:7.1f} ms")
+
+    if timings[BUDGETED] > args.budget_ms:
+        print(f"{BUDGETED} takes {timings[BUDGETED]:.1f} ms to import, over the {args.budget_ms:.0f} ms budget")
+        sys.exit(1)
@@ -0,0 +1,104 @@
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+
+from benchmarks.synthetic import write_export
+from personality import (MODEL, RESPONSE_TOKENS, TEMPERATURE, collect_predictions, create_adaptive_chunks,
+                         load_conversations, parse_prediction_lines, summarize_predictions)
+from prompts import compact_prompt, decode_prediction, verbose_prompt
+from tokens import estimate_tokens
+
+# Prompt tokens of the compact chunk format against the original one, per
+# corpus, and how often the two formats lead to the same predictions. Agreement
+# needs a completion endpoint: by default a noise-free local fake_openai server,
+# which only checks the plumbing (anything under 100% means aliases were mapped
+# back to the wrong people). Point --base-url at the real API, with
+# OPENAI_API_KEY set, to measure agreement for real.
+#
+# Run from py/: python -m benchmarks.bench_prompt --lines 20000
+
+SYNTHETIC_FORMATS = ["whatsapp_ios", "whatsapp_android", "whatsapp_fr"]
+REAL_CORPORA = [os.path.join(os.path.dirname(__file__), "..", "..", name) for name in ("_chat.txt", "Chat2 (1).txt")]
+FAKE_PORT = 8096
+
+
+def token_counts(messages, chunks):
+    verbose = sum(estimate_tokens(verbose_prompt(messages[start:end])) for start, end in chunks)
+    compact = sum(estimate_tokens(compact_prompt(messages[start:end])[0]) for start, end in chunks)
+    return verbose, compact
+
+
+async def predict(scheduler, prompt, aliases):
+    result = await scheduler.chat_completion({
+        "model": MODEL,
+        "messages": [{"role": "user", "content": prompt}],
+        "temperature": TEMPERATURE,
+    }, tokens=estimate_tokens(prompt) + RESPONSE_TOKENS)
+    return decode_prediction(result["choices"][0]["message"]["content"], aliases)
+
+
+async def agreement(scheduler, messages, chunks):
+    # (share of MBTI letters both formats agree on per chunk and participant, share of final types that match)
+    verbose = await asyncio.gather(*(predict(scheduler, verbose_prompt(messages[start:end]), {}) for start, end in chunks))
+    compact = await asyncio.gather(*(predict(scheduler, *compact_prompt(messages[start:end])) for start, end in chunks))
+
+    matching = compared = 0
+    for old, new in zip(verbose, compact):
+        new_types = dict(parse_prediction_lines(new))
+        for participant, old_type in parse_prediction_lines(old):
+            new_type = new_types.get(participant)
+            if new_type is None or len(new_type) != 4 or len(old_type) != 4:
+                continue
+            matching += sum(a == b for a, b in zip(old_type, new_type))
+            compared += 4
+
+    old_final = summarize_predictions(collect_predictions(verbose))[0]
+    new_final = summarize_predictions(collect_predictions(compact))[0]
+    same = sum(old_final[participant] == new_final.get(participant) for participant in old_final)
+    return matching / compared if compared else 0.0, same / len(old_final) if old_final else 0.0
+
+
+async def measure(corpora, chunk_count, base_url):
+    from scheduler import RequestScheduler
+
+    fake_runner = None
+    if base_url is None:
+        from fake_openai import start_fake_server
+        fake_runner, _ = await start_fake_server(port=FAKE_PORT, latency=0.0, jitter=0.0, noise=0.0)
+        scheduler = RequestScheduler(api_key="benchmark", base_url=f"http://127.0.0.1:{FAKE_PORT}/v1",
+                                     requests_per_minute=10**9, tokens_per_minute=10**12)
+    else:
+        scheduler = RequestScheduler(api_key=os.getenv("OPENAI_API_KEY"), base_url=base_url)
+    try:
+        async with scheduler:
+            for name, path in corpora:
+                messages, _ = load_conversations(path)
+                chunks = create_adaptive_chunks(messages, chunk_count)
+                verbose, compact = token_counts(messages, chunks)
+                letters, finals = await agreement(scheduler, messages, chunks)
+                print(f"{name:<18} {len(chunks):>5} chunks {verbose:>10,} -> {compact:>10,} tokens "
+                      f"({1 - compact / verbose:6.1%} fewer)  letters agree {letters:6.1%}  final types agree {finals:6.1%}")
+    finally:
+        if fake_runner is not None:
+            await fake_runner.cleanup()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    arg_parser = argparse.ArgumentParser(description="Token reduction and prediction agreement of compact prompts")
+    arg_parser.add_argument("--lines", type=int, default=20000, help="lines per synthetic export")
+    arg_parser.add_argument("--chunks", type=int, default=100, help="target chunk count per corpus")
+    arg_parser.add_argument("--base-url", default=None, help="completion endpoint (default: a local fake_openai server)")
+    arg_parser.add_argument("files", nargs="*", default=None, help="real exports (default: _chat.txt and Chat2 (1).txt)")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        corpora = []
+        for fmt in SYNTHETIC_FORMATS:
+            path = os.path.join(directory, f"{fmt}.txt")
+            write_export(path, fmt, args.lines)
+            corpora.append((fmt, path))
+        corpora += [(os.path.basename(path), path) for path in args.files or REAL_CORPORA if os.path.exists(path)]
+        asyncio.run(measure(corpora, args.chunks, args.base_url))
@@ -0,0 +1,47 @@
+import argparse
+import random
+import time
+from datetime import datetime, timedelta
+
+from dateutil import parser
+
+from parsers.registry import get_registry
+from parsers.timestamps import decoder_for
+from parsers.universal import Message, clean, iter_records, sample_timestamps
+
+# Run from py/: python -m benchmarks.bench_timestamps --lines 1000000
+
+
+def whatsapp_lines(count, seed=0):
+    rng = random.Random(seed)
+    users = ["Andrew", "Matthieu Huss"]
+    date = datetime(2024, 4, 3, 13, 40)
+    for _ in range(count):
+        date += timedelta(seconds=rng.randint(1, 400))
+        stamp = f"{date.month}/{date.day}/{date:%y}, {date:%I}:{date:%M:%S} {date:%p}".replace(", 0", ", ")
+        yield f"[{stamp}] {rng.choice(users)}: message number {rng.randint(0, 10**6)}\n"
+
+
+def run(lines, pattern, decode):
+    start = time.perf_counter()
+    count = 0
+    for timestamp, user, message in iter_records(lines, pattern):
+        Message(user=user, message=clean(message), date=decode(timestamp))
+        count += 1
+    return count, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Messages/sec with dateutil vs the inferred timestamp layout")
+    arg_parser.add_argument("--lines", type=int, default=1_000_000)
+    args = arg_parser.parse_args()
+
+    lines = list(whatsapp_lines(args.lines))
+    pattern = get_registry().detect(lines[:200])
+    decoder = decoder_for(sample_timestamps(lines[:200], pattern))
+
+    count, before = run(lines, pattern, parser.parse)
+    print(f"dateutil.parser.parse: {count / before:,.0f} messages/sec ({before:.2f}s)")
+    count, after = run(lines, pattern, decoder)
+    print(f"{decoder.layout}: {count / after:,.0f} messages/sec ({after:.2f}s, {decoder.fallbacks} fallbacks)")
+    print(f"speedup: {before / after:.1f}x")
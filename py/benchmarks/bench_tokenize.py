@@ -0,0 +1,57 @@
+import argparse
+import random
+import re
+import time
+
+from parsers.tokenization import Vocabulary, tokenize_many
+
+# Run from py/: python -m benchmarks.bench_tokenize --messages 1000000
+
+WORDS = ("hey what are you doing tonight lol i dont know maybe we could get food "
+         "Thats GREAT!! see you at 7 ok? can't wait haha").split()
+EXTRAS = ["https://example.com/some/path", "www.example.org", "\U0001F602", "\U0001F44D", "\U0001F680", "\U0001F1EB\U0001F1F7"]
+
+
+def synthetic_messages(count, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        words = rng.choices(WORDS, k=rng.randint(1, 20))
+        if rng.random() < 0.2:
+            words.insert(rng.randint(0, len(words)), rng.choice(EXTRAS))
+        messages.append(" ".join(words))
+    return messages
+
+
+def per_message(messages):
+    # The previous path: regexes recompiled from the cache on every call, one message at a time
+    cleaned = [re.sub(r'http\S+|www\S+|https\S+', '', message, flags=re.MULTILINE) for message in messages]
+    return [re.sub(r'[^a-z0-9\s]', '', message.lower()).split() for message in cleaned]
+
+
+def batched(messages):
+    # tokenize_many drops URLs itself, so no clean_many pass
+    return tokenize_many(messages)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Messages/sec for per-message vs batched tokenization")
+    arg_parser.add_argument("--messages", type=int, default=1_000_000)
+    args = arg_parser.parse_args()
+
+    messages = synthetic_messages(args.messages)
+    old, old_seconds = timed(per_message, messages)
+    new, new_seconds = timed(batched, messages)
+    ids, encode_seconds = timed(Vocabulary().encode_many, new)
+
+    mismatches = sum(a != b for a, b in zip(old, new))
+    print(f"per-message: {len(messages) / old_seconds:,.0f} msg/s")
+    print(f"batched:     {len(messages) / new_seconds:,.0f} msg/s ({old_seconds / new_seconds:.1f}x)")
+    print(f"interning:   {len(messages) / encode_seconds:,.0f} msg/s")
+    print(f"mismatches: {mismatches}")
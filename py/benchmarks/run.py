@@ -0,0 +1,239 @@
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+import personality
+from benchmarks.synthetic import FORMATS, write_export
+from fake_openai import start_fake_server
+from parsers.hangouts import parse_hangouts
+from parsers.tokenization import tokenize_many
+from parsers.universal import parse, parse_records
+from parsers.whatsapp import parse_whatsapp
+from scheduler import RequestScheduler
+from sentiment import score_messages
+from word_scores import UserWordCounts
+
+# Benchmark suite for the Python pipeline on synthetic exports. Each case is
+# timed (best of --repeat) and then run once more under tracemalloc for peak
+# memory. Results go to benchmarks/results/<commit>.json; pass --compare with
+# an older file to see the change per case.
+#
+# Run from py/: python -m benchmarks.run --lines 100000 --compare benchmarks/results/<old>.json
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+FAKE_PORT = 8099
+
+# universal.parse only knows regexes.json formats without asking the LLM; the
+# CHAT_PATTERNS formats are timed through parse_records with their pattern given
+NAMED_PATTERNS = {
+    "whatsapp_android": r"(?P<timestamp>\d{2}/\d{2}/\d{4},\s+\d{2}:\d{2})\s+-\s+(?P<user>[^:]+):\s+(?P<message>.*)",
+    "whatsapp_fr": r"(?P<timestamp>\d{4}-\d{2}-\d{2},\s+\d{1,2}:\d{2}\s+[ap]\.m\.)\s+-\s+(?P<user>[^:]+):\s+(?P<message>.*)",
+}
+
+
+def read_text(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def read_lines(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.readlines()
+
+
+def bench_universal_parse(text):
+    return len(parse(text))
+
+
+def bench_parse_records(path, pattern):
+    return sum(1 for _ in parse_records(path, pattern))
+
+
+def bench_parse_whatsapp(text):
+    # parse_whatsapp prints every line it sees
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        return len(parse_whatsapp(text))
+
+
+def bench_parse_hangouts(text):
+    return len(parse_hangouts(text))
+
+
+def bench_extract_conversations(lines):
+    messages, _ = personality.extract_conversations(lines)
+    return len(messages)
+
+
+def extracted(path):
+    messages, _ = personality.extract_conversations(read_lines(path))
+    return (messages,)
+
+
+def bench_create_chunks(messages):
+    return len(personality.create_adaptive_chunks(messages, 100, 3))
+
+
+def chunked(path):
+    messages, _ = personality.extract_conversations(read_lines(path))
+    return messages, personality.create_adaptive_chunks(messages, 100, 3)
+
+
+def bench_create_prompt(messages, chunks):
+    for start, end in chunks:
+        personality.create_prompt(messages, start, end)
+    return sum(end - start for start, end in chunks)
+
+
+def bench_word_ratios(messages):
+    # Same steps as TestCloud: tokenize, count per user, ratio against everyone else
+    tokens = tokenize_many(message for _, message in messages)
+    word_counts = UserWordCounts.from_tokens(zip((sender for sender, _ in messages), tokens))
+    word_counts.top_k(word_counts.ratios(), 200)
+    return len(messages)
+
+
+def bench_sentiment(messages):
+    score_messages([message for _, message in messages])
+    return len(messages)
+
+
+def bench_predict_mbti(path):
+    async def run():
+        runner, _ = await start_fake_server(port=FAKE_PORT, latency=0.0, jitter=0.0)
+        try:
+            with tempfile.TemporaryDirectory() as cache_dir:
+                scheduler = RequestScheduler(api_key="benchmark", base_url=f"http://127.0.0.1:{FAKE_PORT}/v1",
+                                             requests_per_minute=10**9, tokens_per_minute=10**12)
+                result = await personality.predict_mbti_from_chat(
+                    path, target_chunk_count=100, cache_path=os.path.join(cache_dir, "cache.sqlite"), scheduler=scheduler
+                )
+                return sum(result[5].values())
+        finally:
+            await runner.cleanup()
+    return asyncio.run(run())
+
+
+# name -> (formats, setup(path, fmt) -> args, function(*args) -> items processed)
+CASES = {
+    "universal.parse": (["hangouts", "whatsapp_ios"], lambda path, fmt: (read_text(path),), bench_universal_parse),
+    "universal.parse_records": (sorted(NAMED_PATTERNS), lambda path, fmt: (path, NAMED_PATTERNS[fmt]), bench_parse_records),
+    "parse_whatsapp": (["whatsapp_ios"], lambda path, fmt: (read_text(path),), bench_parse_whatsapp),
+    "parse_hangouts": (["hangouts"], lambda path, fmt: (read_text(path),), bench_parse_hangouts),
+    "extract_conversations": (["whatsapp_ios", "whatsapp_android", "whatsapp_fr"], lambda path, fmt: (read_lines(path),),
+                              bench_extract_conversations),
+    "create_adaptive_chunks": (["whatsapp_ios"], lambda path, fmt: extracted(path), bench_create_chunks),
+    "create_prompt": (["whatsapp_ios"], lambda path, fmt: chunked(path), bench_create_prompt),
+    "word_ratios": (["whatsapp_ios"], lambda path, fmt: extracted(path), bench_word_ratios),
+    "sentiment": (["whatsapp_ios"], lambda path, fmt: extracted(path), bench_sentiment),
+    "predict_mbti_from_chat": (["whatsapp_ios"], lambda path, fmt: (path,), bench_predict_mbti),
+}
+
+
+def measure(function, args, repeat, memory):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        function(*args)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return items, best, peak
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, dirty
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(case["name"], case["format"]): case for case in json.load(f)["results"]}
+    print(f"\nAgainst {baseline_path}:")
+    for case in results:
+        old = baseline.get((case["name"], case["format"]))
+        if old is None:
+            continue
+        line = f"  {case['name']:<26} {case['format']:<18} time x{case['seconds'] / old['seconds']:.2f}"
+        if case["peak_bytes"] and old.get("peak_bytes"):
+            line += f", peak memory x{case['peak_bytes'] / old['peak_bytes']:.2f}"
+        print(line)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Time the Python pipeline on synthetic chat exports")
+    arg_parser.add_argument("--lines", type=int, default=100_000, help="lines per synthetic export (1k-10M)")
+    arg_parser.add_argument("--participants", type=int, default=2)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    arg_parser.add_argument("--only", nargs="*", choices=sorted(CASES), help="run only these cases")
+    arg_parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    arg_parser.add_argument("--output", default=None, help="results file (default: benchmarks/results/<commit>.json)")
+    arg_parser.add_argument("--compare", default=None, help="earlier results file to compare against")
+    args = arg_parser.parse_args()
+
+    # Per-chunk progress logging would be timed along with the work
+    logging.disable(logging.INFO)
+    commit, dirty = git_revision()
+    results = []
+    with tempfile.TemporaryDirectory() as data_dir:
+        exports = {}
+        for fmt in FORMATS:
+            exports[fmt] = write_export(os.path.join(data_dir, f"{fmt}.txt"), fmt, args.lines,
+                                        participants=args.participants, seed=args.seed)
+
+        for name in args.only or CASES:
+            formats, setup, function = CASES[name]
+            for fmt in formats:
+                items, seconds, peak = measure(function, setup(exports[fmt], fmt), args.repeat, not args.no_memory)
+                results.append({
+                    "name": name,
+                    "format": fmt,
+                    "lines": args.lines,
+                    "items": items,
+                    "seconds": seconds,
+                    "lines_per_second": args.lines / seconds,
+                    "peak_bytes": peak,
+                })
+                memory = f", peak {peak / 2**20:.1f} MiB" if peak is not None else ""
+                print(f"{name:<26} {fmt:<18} {seconds:8.3f}s  {args.lines / seconds:>12,.0f} lines/s{memory}")
+
+    report = {
+        "commit": commit,
+        "dirty": dirty,
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "lines": args.lines,
+        "participants": args.participants,
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "results": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{(commit or 'unknown')[:12]}{'-dirty' if dirty else ''}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}")
+
+    if args.compare:
+        compare(results, args.compare)
@@ -0,0 +1,126 @@
+import argparse
+import random
+from datetime import datetime, timedelta
+
+# Seeded synthetic chat exports for benchmarks. Every format in
+# parsers/regexes.json and personality.CHAT_PATTERNS is covered, with
+# multi-line messages and system notices mixed in. Output is streamed, so
+# 10M-line files don't need 10M lines in memory.
+#
+# Run from py/: python -m benchmarks.synthetic whatsapp_ios 1000000 /tmp/chat.txt
+
+NAMES = ["Andrew Mackenzie", "Matthieu Huss", "Kai", "Sophie Tremblay", "Unknown", "Priya", "Jonas", "Léa Gagnon",
+         "Tom", "Amélie", "Sam O'Neil", "Rosa", "Daniel", "Chen Wei", "Maya", "Olu"]
+WORDS = ("hey what are you doing tonight lol i dont know maybe we could get food later thats great see you at "
+         "ok cant wait haha yeah no sure sounds good did you see the game I'm on my way running late sorry "
+         "tomorrow work was so long love it omg really wait what").split()
+EXTRAS = ["https://example.com/invite/SOVKFMV029?placement=PostBooking", "www.example.org/menu", "\U0001F602", "\U0001F44D",
+          "ça va?", "<Media omitted>", "12:30", "$40"]
+
+
+def _whatsapp_ios(date):
+    hour = date.hour % 12 or 12
+    return f"[{date.month}/{date.day}/{date:%y}, {hour}:{date:%M:%S} {date:%p}]"
+
+
+def _whatsapp_fr(date):
+    hour = date.hour % 12 or 12
+    return f"{date:%Y-%m-%d}, {hour}:{date:%M} {'a.m.' if date.hour < 12 else 'p.m.'}"
+
+
+# name -> (header for a message, line for a system notice)
+FORMATS = {
+    # parsers/regexes.json[0], parsers/hangouts.py
+    "hangouts": (
+        lambda date, user, text: f"{date:%Y-%m-%d %H:%M:%S} <{user}> {text}",
+        lambda date, notice: f"{date:%Y-%m-%d %H:%M:%S} *** {notice}",
+    ),
+    # parsers/regexes.json[1], parsers/whatsapp.py, CHAT_PATTERNS[0]
+    "whatsapp_ios": (
+        lambda date, user, text: f"{_whatsapp_ios(date)} {user}: {text}",
+        lambda date, notice: f"{_whatsapp_ios(date)} {notice}",
+    ),
+    # CHAT_PATTERNS[1]
+    "whatsapp_android": (
+        lambda date, user, text: f"{date:%d/%m/%Y, %H:%M} - {user}: {text}",
+        lambda date, notice: f"{date:%d/%m/%Y, %H:%M} - {notice}",
+    ),
+    # CHAT_PATTERNS[2]
+    "whatsapp_fr": (
+        lambda date, user, text: f"{_whatsapp_fr(date)} - {user}: {text}",
+        lambda date, notice: f"{_whatsapp_fr(date)} - {notice}",
+    ),
+}
+
+NOTICES = [
+    "Messages and calls are end-to-end encrypted. No one outside of this chat can read or listen to them.",
+    "{user} added {other}",
+    "{user} changed the group name to \"weekend plans\"",
+    "{user} left",
+]
+# Header-shaped notice, dropped through personality.SYSTEM_SENDERS
+ENCRYPTION_SENDER = "Messages and calls are end-to-end encrypted."
+
+
+def _sentence(rng):
+    words = rng.choices(WORDS, k=rng.randint(1, 18))
+    if rng.random() < 0.15:
+        words.insert(rng.randint(0, len(words)), rng.choice(EXTRAS))
+    return " ".join(words)
+
+
+def iter_lines(fmt, line_count, participants=2, seed=0, multiline_rate=0.05, notice_rate=0.002,
+               start=datetime(2021, 3, 14, 9, 26, 53)):
+    # Exactly line_count lines, without trailing newlines
+    header, notice = FORMATS[fmt]
+    rng = random.Random(seed)
+    users = NAMES[:participants] if participants <= len(NAMES) else [f"User {i}" for i in range(participants)]
+    date = start
+    emitted = 0
+
+    if fmt != "hangouts" and line_count:
+        yield header(date, ENCRYPTION_SENDER, "No one outside of this chat can read them.")
+        emitted += 1
+
+    while emitted < line_count:
+        date += timedelta(seconds=int(rng.expovariate(1 / 300)) + 1)
+        if rng.random() < notice_rate:
+            user, other = rng.sample(users, 2) if len(users) > 1 else (users[0], users[0])
+            yield notice(date, rng.choice(NOTICES).format(user=user, other=other))
+            emitted += 1
+            continue
+
+        yield header(date, rng.choice(users), _sentence(rng))
+        emitted += 1
+        if rng.random() < multiline_rate:
+            for _ in range(min(rng.randint(1, 4), line_count - emitted)):
+                yield _sentence(rng) if rng.random() < 0.8 else ""
+                emitted += 1
+
+
+def generate_text(fmt, line_count, **options):
+    return "\n".join(iter_lines(fmt, line_count, **options)) + "\n"
+
+
+def write_export(path, fmt, line_count, **options):
+    with open(path, "w", encoding="utf-8") as f:
+        batch = []
+        for line in iter_lines(fmt, line_count, **options):
+            batch.append(line)
+            if len(batch) >= 10000:
+                f.write("\n".join(batch) + "\n")
+                batch = []
+        if batch:
+            f.write("\n".join(batch) + "\n")
+    return path
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Write a seeded synthetic chat export")
+    arg_parser.add_argument("format", choices=sorted(FORMATS))
+    arg_parser.add_argument("lines", type=int)
+    arg_parser.add_argument("output")
+    arg_parser.add_argument("--participants", type=int, default=2)
+    arg_parser.add_argument("--seed", type=int, default=0)
+    args = arg_parser.parse_args()
+    write_export(args.output, args.format, args.lines, participants=args.participants, seed=args.seed)
@@ -0,0 +1,135 @@
+import argparse
+import json
+import logging
+import os
+import sys
+
+# Single entry point for the Python tools. Each subcommand imports what it needs
+# when it runs, so `cli.py parse` never loads aiohttp, scipy or wordcloud.
+#
+# Run from py/:
+#   python cli.py parse chat.txt > messages.jsonl
+#   python cli.py cloud chat.txt --format png
+#   python cli.py mbti chat.txt --early-stopping
+#   python cli.py index chat.txt chat_index.npz --chart-json weekly.json
+#   python cli.py sentiment chat.txt sentiment.json
+
+
+def run_parse(args):
+    from parsers.universal import parse_parallel, parse_records
+
+    if args.workers:
+        records = parse_parallel(args.chat_file, args.pattern, args.workers)
+    else:
+        records = parse_records(args.chat_file, args.pattern)
+    out = sys.stdout
+    try:
+        for user, message, date in records:
+            out.write(json.dumps({"user": user, "message": message, "date": date.isoformat()}, ensure_ascii=False) + "\n")
+        out.flush()
+    except BrokenPipeError:
+        # Output piped into head or similar; stop quietly
+        sys.stdout = open(os.devnull, "w")
+
+
+def run_cloud(args):
+    import TestCloud
+
+    TestCloud.main(args.chat_file, args.format)
+
+
+def run_mbti(args):
+    import asyncio
+
+    from personality import run_analysis
+
+    options = {
+        "token_budget": args.token_budget,
+        "early_stopping": args.early_stopping,
+        "confidence": args.confidence,
+        "max_requests": args.max_requests,
+        "workers": args.workers,
+    }
+    if args.cache:
+        options["cache_path"] = args.cache
+    message_range = tuple(args.range) if args.range else None
+    asyncio.run(run_analysis(args.chat_file, message_range, args.chunks, args.min_messages, **options))
+
+
+def run_index(args):
+    from analytics_index import build_index
+
+    index = build_index(args.chat_file, args.index, args.pattern)
+    if args.chart_json:
+        with open(args.chart_json, "w", encoding="utf-8") as f:
+            json.dump(index.chart_series(args.unit, metric=args.metric), f, ensure_ascii=False)
+
+
+def run_sentiment(args):
+    import asyncio
+
+    from sentiment import analyse_file
+
+    result = asyncio.run(analyse_file(args.chat_file, args.pattern, refine=args.refine, cache_path=args.cache))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
+
+
+def build_parser():
+    arg_parser = argparse.ArgumentParser(description="Chat export analysis")
+    arg_parser.add_argument("-v", "--verbose", action="store_true", help="debug logging")
+    arg_parser.add_argument("-q", "--quiet", action="store_true", help="warnings and errors only")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+
+    parse_parser = subcommands.add_parser("parse", help="parse an export into JSON lines on stdout")
+    parse_parser.add_argument("chat_file")
+    parse_parser.add_argument("--pattern", default=None, help="regex with timestamp/user/message groups (default: detect)")
+    parse_parser.add_argument("--workers", type=int, default=None, help="parse large files across this many processes")
+    parse_parser.set_defaults(handler=run_parse)
+
+    cloud_parser = subcommands.add_parser("cloud", help="per-user word clouds")
+    cloud_parser.add_argument("chat_file")
+    cloud_parser.add_argument("--format", choices=["png", "svg"], default=None, help="write images instead of showing them")
+    cloud_parser.set_defaults(handler=run_cloud)
+
+    mbti_parser = subcommands.add_parser("mbti", help="predict MBTI types of the participants")
+    mbti_parser.add_argument("chat_file")
+    mbti_parser.add_argument("--chunks", type=int, default=100, help="target chunk count")
+    mbti_parser.add_argument("--min-messages", type=int, default=3, help="minimum messages per participant in a chunk")
+    mbti_parser.add_argument("--token-budget", type=int, default=None, help="size chunks by prompt tokens instead")
+    mbti_parser.add_argument("--range", type=int, nargs=2, metavar=("START", "END"), default=None, help="only these messages")
+    mbti_parser.add_argument("--early-stopping", action="store_true", help="stop once every axis is decided")
+    mbti_parser.add_argument("--confidence", type=float, default=0.95)
+    mbti_parser.add_argument("--max-requests", type=int, default=None)
+    mbti_parser.add_argument("--workers", type=int, default=None)
+    mbti_parser.add_argument("--cache", default=None, help="LLM response cache (default: LLM_CACHE_PATH or llm_cache.sqlite)")
+    mbti_parser.set_defaults(handler=run_mbti)
+
+    index_parser = subcommands.add_parser("index", help="precompute per-user time-bucketed aggregates for charts")
+    index_parser.add_argument("chat_file")
+    index_parser.add_argument("index", help="output .npz")
+    index_parser.add_argument("--pattern", default=None, help="regex with timestamp/user/message groups (default: detect)")
+    index_parser.add_argument("--chart-json", default=None, help="also write a chart series as JSON")
+    index_parser.add_argument("--unit", choices=["hour", "day", "week"], default="week")
+    index_parser.add_argument("--metric", choices=["words", "messages"], default="words")
+    index_parser.set_defaults(handler=run_index)
+
+    sentiment_parser = subcommands.add_parser("sentiment", help="per-user weekly sentiment series for charts")
+    sentiment_parser.add_argument("chat_file")
+    sentiment_parser.add_argument("output", help="output JSON")
+    sentiment_parser.add_argument("--pattern", default=None, help="regex with timestamp/user/message groups (default: detect)")
+    sentiment_parser.add_argument("--refine", action="store_true", help="re-score low-confidence messages with the LLM")
+    sentiment_parser.add_argument("--cache", default=None, help="LLM response cache for --refine")
+    sentiment_parser.set_defaults(handler=run_sentiment)
+    return arg_parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    level = logging.DEBUG if args.verbose else logging.WARNING if args.quiet else logging.INFO
+    logging.basicConfig(level=level, format='%(asctime)s - %(levelname)s - %(message)s')
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import asyncio
+import hashlib
+import random
+import re
+import time
+
+from aiohttp import web
+
+# Local stand-in for the chat completions endpoint. Point the pipeline at it with
+# OPENAI_API_BASE=http://127.0.0.1:8089/v1 (or RequestScheduler(base_url=...)).
+
+MBTI_AXES = ["EI", "NS", "TF", "JP"]
+_SPEAKER = re.compile(r'^([^:\n]{1,80}):\s', re.MULTILINE)
+_ALIAS = re.compile(r'^([A-Z]{1,2}) = (.+)$', re.MULTILINE)
+_NUMBERED = re.compile(r'^(\d+)\. (.*)$', re.MULTILINE)
+
+
+def _seeded(*parts):
+    return random.Random(hashlib.sha256("\x00".join(parts).encode("utf-8")).digest())
+
+
+def fake_mbti(name, prompt, noise=0.2):
+    # Each name has a stable "true" type; every prompt flips each letter with probability noise
+    true_type = _seeded("type", name)
+    chunk = _seeded("chunk", name, prompt)
+    letters = []
+    for axis in MBTI_AXES:
+        letter = axis[true_type.random() < 0.5]
+        if chunk.random() < noise:
+            letter = axis[axis[0] == letter]
+        letters.append(letter)
+    return "".join(letters)
+
+
+def fake_sentiment(message):
+    # A stable rating per message text
+    return round(_seeded("sentiment", message).uniform(-10, 10), 1)
+
+
+def fake_completion(prompt, noise=0.2):
+    # sentiment.refine_scores asks for numbered ratings, one per numbered message
+    if prompt.startswith("Rate the sentiment"):
+        return "\n".join(f"{number}: {fake_sentiment(message)}" for number, message in _NUMBERED.findall(prompt))
+    # Compact prompts name participants by alias with an "A = Name" legend; the
+    # reply uses the aliases but the types stay tied to the names
+    legend = dict(_ALIAS.findall(prompt))
+    if legend:
+        return "\n".join(f"{alias}: {fake_mbti(name, prompt, noise)}" for alias, name in legend.items())
+    speakers = []
+    for name in _SPEAKER.findall(prompt):
+        if name not in speakers:
+            speakers.append(name)
+    return "\n".join(f"{name}: {fake_mbti(name, prompt, noise)}" for name in speakers)
+
+
+class FakeOpenAI:
+    def __init__(self, latency=0.2, jitter=0.1, error_rate=0.0, requests_per_minute=None, retry_after=1.0, noise=0.2, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests_per_minute = requests_per_minute
+        self.retry_after = retry_after
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.window = []
+        self.stats = {"requests": 0, "throttled": 0, "completed": 0}
+
+    def _over_limit(self):
+        if not self.requests_per_minute:
+            return False
+        now = time.monotonic()
+        self.window = [t for t in self.window if now - t < 60]
+        if len(self.window) >= self.requests_per_minute:
+            return True
+        self.window.append(now)
+        return False
+
+    async def chat_completions(self, request):
+        self.stats["requests"] += 1
+        payload = await request.json()
+        if self._over_limit() or self.random.random() < self.error_rate:
+            self.stats["throttled"] += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded"}},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+
+        await asyncio.sleep(max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)))
+        prompt = "\n".join(message["content"] for message in payload.get("messages", []))
+        content = fake_completion(prompt, self.noise)
+        self.stats["completed"] += 1
+        return web.json_response({
+            "id": f"chatcmpl-fake-{self.stats['requests']}",
+            "object": "chat.completion",
+            "model": payload.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": len(content) // 4},
+        })
+
+    def app(self):
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        return app
+
+
+async def start_fake_server(host="127.0.0.1", port=8089, **options):
+    # Returns (runner, fake); await runner.cleanup() to stop it
+    fake = FakeOpenAI(**options)
+    runner = web.AppRunner(fake.app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner, fake
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions endpoint")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8089)
+    arg_parser.add_argument("--latency", type=float, default=0.2, help="mean response time in seconds")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    arg_parser.add_argument("--rpm", type=int, default=None, help="requests per minute before answering with 429s")
+    arg_parser.add_argument("--retry-after", type=float, default=1.0)
+    args = arg_parser.parse_args()
+
+    fake = FakeOpenAI(latency=args.latency, error_rate=args.error_rate, requests_per_minute=args.rpm, retry_after=args.retry_after)
+    web.run_app(fake.app(), host=args.host, port=args.port)
@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import math
+import os
+import time
+from collections import Counter
+
+from llm_cache import DEFAULT_CACHE_PATH, LLMCache
+from parsers.reader import iter_lines
+from personality import (create_adaptive_chunks, extract_conversations, is_message_start, openai_api_key,
+                         parse_prediction_lines, run_chunks, summarize_predictions)
+logger = logging.getLogger(__name__)
+
+# Incremental MBTI analysis for chats that are re-exported with new messages
+# appended. A state file next to the export records how far the last run got;
+# the next run only parses the bytes past that point, keeps every earlier chunk
+# boundary and only sends the new chunks.
+
+STATE_VERSION = 1
+READ_BLOCK = 1 << 20
+
+
+def state_path_for(file_path):
+    return f"{file_path}.mbti_state.json"
+
+
+def hash_prefix(file_path, length):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        remaining = length
+        while remaining:
+            block = f.read(min(READ_BLOCK, remaining))
+            if not block:
+                break
+            digest.update(block)
+            remaining -= len(block)
+    return digest.hexdigest()
+
+
+def extend_message_digest(previous, messages):
+    # Chained per run: sha256(previous digest + sha256 of this run's messages)
+    digest = hashlib.sha256()
+    for sender, message in messages:
+        digest.update(f"{sender}\x00{message}\x01".encode("utf-8"))
+    return hashlib.sha256(bytes.fromhex(previous) + digest.digest()).hexdigest()
+
+
+def load_state(state_path):
+    if not os.path.exists(state_path):
+        return None
+    with open(state_path, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    if state.get("version") != STATE_VERSION:
+        logger.info(f"Ignoring state file {state_path} from another version")
+        return None
+    return state
+
+
+def save_state(state_path, state):
+    # Write-then-rename so a crash never leaves a half-written state behind
+    temp_path = f"{state_path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(temp_path, state_path)
+
+
+def new_state():
+    return {
+        "version": STATE_VERSION,
+        "byte_offset": 0,
+        "prefix_sha256": hashlib.sha256().hexdigest(),
+        "ends_with_newline": True,
+        "message_count": 0,
+        "checkpoints": [[0, hashlib.sha256().hexdigest()]],
+        "chunk_size": None,
+        "chunks": [],
+        "pending": [],
+        "type_counts": {},
+        "message_counts": {},
+    }
+
+
+def read_tail(file_path, state):
+    # Messages appended since the last run, or None if the file doesn't extend it
+    offset = state["byte_offset"]
+    if os.path.getsize(file_path) < offset or not state["ends_with_newline"]:
+        return None
+    if hash_prefix(file_path, offset) != state["prefix_sha256"]:
+        return None
+    lines = list(iter_lines(file_path, offset))
+    # The tail has to start a new message, otherwise it continues one that was already analysed
+    first = next((line for line in lines if line.strip()), None)
+    if first is not None and not is_message_start(first):
+        return None
+    messages, _ = extract_conversations(lines)
+    return messages
+
+
+def matches_history(messages, state):
+    # Slow path: re-parsed the whole export, check it still starts with everything analysed
+    if len(messages) < state["message_count"]:
+        return False
+    previous = state["checkpoints"][0][1]
+    for (start, _), (end, digest) in zip(state["checkpoints"], state["checkpoints"][1:]):
+        previous = extend_message_digest(previous, messages[start:end])
+        if previous != digest:
+            return False
+    return True
+
+
+def plan_new_chunks(messages, state, target_chunk_count, min_messages_per_participant):
+    # Chunks for the messages past the last analysed chunk, at the chunk size the chat started with.
+    # A remainder too small to judge anyone on waits for the next export.
+    if state["chunk_size"] is None:
+        chunks = create_adaptive_chunks(messages, target_chunk_count, min_messages_per_participant)
+        state["chunk_size"] = max(math.ceil(len(messages) / target_chunk_count), min_messages_per_participant * 2)
+        return chunks, len(messages)
+
+    chunk_size = state["chunk_size"]
+    if len(messages) < chunk_size:
+        return [], 0
+    chunks = create_adaptive_chunks(messages, len(messages) // chunk_size, min_messages_per_participant)
+    smallest = max(min_messages_per_participant * 2, chunk_size // 4)
+    if chunks and chunks[-1][1] - chunks[-1][0] < smallest:
+        chunks.pop()
+    return chunks, chunks[-1][1] if chunks else 0
+
+
+async def analyse_incremental(file_path, state_path=None, target_chunk_count=100, min_messages_per_participant=3,
+                              cache_path=DEFAULT_CACHE_PATH, scheduler=None):
+    overall_start_time = time.time()
+    state_path = state_path or state_path_for(file_path)
+    state = load_state(state_path)
+
+    tail = read_tail(file_path, state) if state else None
+    if tail is not None:
+        logger.info(f"{file_path} extends the analysed export, parsed {len(tail)} new messages")
+        new_messages = tail
+    else:
+        all_messages, _ = extract_conversations(iter_lines(file_path))
+        if state and matches_history(all_messages, state):
+            logger.info(f"{file_path} re-parsed in full, history matches, {len(all_messages) - state['message_count']} new messages")
+        else:
+            if state:
+                logger.info(f"{file_path} doesn't extend the analysed export, starting over")
+            state = new_state()
+        new_messages = all_messages[state["message_count"]:]
+
+    # Messages held back last time go in front of the new ones
+    base = state["message_count"] - len(state["pending"])
+    messages = [tuple(message) for message in state["pending"]] + new_messages
+    chunks, used = plan_new_chunks(messages, state, target_chunk_count, min_messages_per_participant)
+    logger.info(f"Analysing {len(chunks)} new chunks, {len(messages) - used} messages held back for the next export")
+
+    if scheduler is None:
+        # aiohttp is only loaded by runs that actually send requests
+        from scheduler import RequestScheduler
+        scheduler = RequestScheduler(api_key=openai_api_key)
+    cache = LLMCache(cache_path)
+    try:
+        async with scheduler:
+            chunk_predictions = await run_chunks(scheduler, messages, chunks, cache)
+    finally:
+        cache.close()
+
+    for chunk_prediction in chunk_predictions:
+        for participant, mbti in parse_prediction_lines(chunk_prediction):
+            counts = state["type_counts"].setdefault(participant, {})
+            counts[mbti] = counts.get(mbti, 0) + 1
+    for sender, count in Counter(sender for sender, _ in new_messages).items():
+        state["message_counts"][sender] = state["message_counts"].get(sender, 0) + count
+
+    state["chunks"].extend([base + start, base + end] for start, end in chunks)
+    state["pending"] = [list(message) for message in messages[used:]]
+    new_count = state["message_count"] + len(new_messages)
+    state["checkpoints"].append([new_count, extend_message_digest(state["checkpoints"][-1][1], new_messages)])
+    state["message_count"] = new_count
+    state["byte_offset"] = os.path.getsize(file_path)
+    state["prefix_sha256"] = hash_prefix(file_path, state["byte_offset"])
+    with open(file_path, "rb") as f:
+        f.seek(max(state["byte_offset"] - 1, 0))
+        state["ends_with_newline"] = f.read(1) in (b"\n", b"")
+    save_state(state_path, state)
+
+    type_counts = {participant: Counter(counts) for participant, counts in state["type_counts"].items()}
+    final_predictions, letter_counts, significances = summarize_predictions(
+        {participant: counts.elements() for participant, counts in type_counts.items()}
+    )
+    logger.info(f"Incremental analysis took {time.time() - overall_start_time:.2f} seconds, {len(state['chunks'])} chunks analysed in total")
+    return final_predictions, type_counts, letter_counts, significances, len(chunks), state["message_counts"]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Analyse only what was appended to a chat export since the last run")
+    arg_parser.add_argument("chat_file")
+    arg_parser.add_argument("--state", default=None, help="state file (default: <chat_file>.mbti_state.json)")
+    arg_parser.add_argument("--chunks", type=int, default=100, help="target chunk count for the first run")
+    args = arg_parser.parse_args()
+
+    final_predictions, type_counts, letter_counts, significances, new_chunks, message_counts = asyncio.run(
+        analyse_incremental(args.chat_file, args.state, args.chunks)
+    )
+    print(f"Analysed {new_chunks} new chunks")
+    for participant, mbti in final_predictions.items():
+        print(f"{participant}: {mbti}")
+        print(f"  Letter Counts: {letter_counts[participant]}")
@@ -0,0 +1,236 @@
+import atexit
+import bisect
+import contextvars
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Lightweight instrumentation: nested timing spans, counters and histograms.
+# Everything is off unless INSTRUMENT_OUTPUT (JSON summary) or INSTRUMENT_TRACE
+# (Chrome trace, open in chrome://tracing or Perfetto) is set, or enable() is
+# called. Disabled, span() hands back a shared no-op context manager and
+# count()/observe() return after one flag check.
+
+MAX_EVENTS = 200_000
+# inspect.CO_COROUTINE, without paying for importing inspect
+_CO_COROUTINE = 0x0080
+# Histogram bucket upper bounds: 0.1ms to ~100s, doubling
+BUCKETS = [0.0001 * 2 ** i for i in range(21)]
+
+_enabled = False
+_lock = threading.Lock()
+_epoch = time.perf_counter()
+_stack = contextvars.ContextVar("instrument_stack", default=())
+_spans = {}
+_counters = {}
+_histograms = {}
+_events = []
+_dropped_events = 0
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("name", "args", "path", "start", "token")
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        parents = _stack.get()
+        self.path = f"{parents[-1]}/{self.name}" if parents else self.name
+        self.token = _stack.set(parents + (self.path,))
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        _stack.reset(self.token)
+        _record_span(self.path, self.name, self.start, end, self.args)
+        return False
+
+
+def _lane():
+    # Chrome trace lanes: one per asyncio task so concurrent requests don't overlap
+    asyncio = sys.modules.get("asyncio")
+    try:
+        task = asyncio.current_task() if asyncio else None
+    except RuntimeError:
+        task = None
+    return id(task) if task is not None else threading.get_ident()
+
+
+def _record_span(path, name, start, end, args):
+    global _dropped_events
+    duration = end - start
+    with _lock:
+        stats = _spans.get(path)
+        if stats is None:
+            stats = _spans[path] = {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0}
+        stats["count"] += 1
+        stats["total_seconds"] += duration
+        stats["max_seconds"] = max(stats["max_seconds"], duration)
+        if len(_events) < MAX_EVENTS:
+            _events.append((name, start, duration, _lane(), args))
+        else:
+            _dropped_events += 1
+
+
+def enabled():
+    return _enabled
+
+
+def enable():
+    global _enabled
+    _enabled = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def reset():
+    global _dropped_events
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _histograms.clear()
+        _events.clear()
+        _dropped_events = 0
+
+
+def span(name, **args):
+    if not _enabled:
+        return _NULL_SPAN
+    return Span(name, args)
+
+
+def traced(name=None):
+    # Decorator: run each call of a function or coroutine function inside a span
+    def decorate(function):
+        span_name = name or function.__qualname__
+        if function.__code__.co_flags & _CO_COROUTINE:
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                if not _enabled:
+                    return await function(*args, **kwargs)
+                with Span(span_name, {}):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return function(*args, **kwargs)
+            with Span(span_name, {}):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def count(name, value=1):
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def observe(name, value):
+    # Adds a value (seconds, for latencies) to a histogram
+    if not _enabled:
+        return
+    with _lock:
+        histogram = _histograms.get(name)
+        if histogram is None:
+            histogram = _histograms[name] = {"count": 0, "sum": 0.0, "min": value, "max": value,
+                                             "buckets": [0] * (len(BUCKETS) + 1)}
+        histogram["count"] += 1
+        histogram["sum"] += value
+        histogram["min"] = min(histogram["min"], value)
+        histogram["max"] = max(histogram["max"], value)
+        histogram["buckets"][bisect.bisect_left(BUCKETS, value)] += 1
+
+
+def _quantile(histogram, q):
+    # Upper bound of the bucket holding the q-th value, capped at the observed max
+    rank = q * histogram["count"]
+    seen = 0
+    for index, bucket_count in enumerate(histogram["buckets"]):
+        seen += bucket_count
+        if seen >= rank and bucket_count:
+            return min(BUCKETS[index], histogram["max"]) if index < len(BUCKETS) else histogram["max"]
+    return histogram["max"]
+
+
+def summary():
+    with _lock:
+        histograms = {}
+        for name, histogram in _histograms.items():
+            histograms[name] = {
+                "count": histogram["count"],
+                "mean": histogram["sum"] / histogram["count"],
+                "min": histogram["min"],
+                "max": histogram["max"],
+                "p50": _quantile(histogram, 0.5),
+                "p90": _quantile(histogram, 0.9),
+                "p99": _quantile(histogram, 0.99),
+                "buckets": {f"<={bound:g}": n for bound, n in zip(BUCKETS + [float("inf")], histogram["buckets"]) if n},
+            }
+        return {
+            "spans": {path: dict(stats) for path, stats in sorted(_spans.items())},
+            "counters": dict(sorted(_counters.items())),
+            "histograms": histograms,
+            "dropped_events": _dropped_events,
+        }
+
+
+def write_summary(path):
+    import json
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(summary(), f, indent=2)
+    logger.info(f"Wrote instrumentation summary to {path}")
+
+
+def write_chrome_trace(path):
+    import json
+    pid = os.getpid()
+    with _lock:
+        trace_events = [
+            {"name": name, "ph": "X", "ts": (start - _epoch) * 1e6, "dur": duration * 1e6, "pid": pid, "tid": lane,
+             "args": {key: value if isinstance(value, (int, float, str, bool)) else str(value) for key, value in args.items()}}
+            for name, start, duration, lane, args in _events
+        ]
+        end = time.perf_counter()
+        trace_events.extend({"name": name, "ph": "C", "ts": (end - _epoch) * 1e6, "pid": pid, "args": {name: value}}
+                            for name, value in _counters.items())
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, f)
+    logger.info(f"Wrote Chrome trace to {path}")
+
+
+def _write_on_exit(summary_path, trace_path):
+    if summary_path:
+        write_summary(summary_path)
+    if trace_path:
+        write_chrome_trace(trace_path)
+
+
+if os.environ.get("INSTRUMENT_OUTPUT") or os.environ.get("INSTRUMENT_TRACE"):
+    enable()
+    atexit.register(_write_on_exit, os.environ.get("INSTRUMENT_OUTPUT"), os.environ.get("INSTRUMENT_TRACE"))
@@ -0,0 +1,417 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import functools
+import itertools
+import json
+import logging
+import math
+import os
+import time
+import uuid
+
+import instrument
+from llm_cache import DEFAULT_CACHE_PATH, LLMCache
+from personality import load_conversations, openai_api_key, predict_mbti_from_messages
+
+logger = logging.getLogger(__name__)
+
+# Long-running MBTI job runner. Exports come in from a watched directory or a
+# local HTTP endpoint and go through parse -> chunk -> analyse as a pipeline:
+# parsing runs in a process pool while earlier jobs are being analysed, and every
+# job's requests go through one RequestScheduler (one pooled session, one
+# concurrency/RPM/TPM budget) and one LLMCache. Requests queue for scheduler slots
+# by job priority, so throughput is set by the API quota rather than by how the
+# jobs happen to interleave.
+#
+# Run from py/:
+#   python jobs.py --inbox uploads/ --output results/
+#   python jobs.py --port 8090 --output results/
+#   curl --data-binary @chat.txt 'http://127.0.0.1:8090/jobs?priority=5'
+#   python jobs.py --inbox uploads/ --output results/ --fake-api --exit-when-idle
+
+PARSE_WORKERS = 2
+# Jobs analysed at once; each holds its messages in memory while it runs
+MAX_ACTIVE_JOBS = 8
+POLL_SECONDS = 2.0
+REPORT_SECONDS = 30.0
+EXPORT_SUFFIXES = (".txt",)
+# Finished and failed jobs kept for GET /jobs; older ones only live on in OUTPUT/<name>.json
+KEEP_FINISHED = 1000
+
+QUEUED, PARSING, PARSED, ANALYSING, DONE, FAILED = "queued", "parsing", "parsed", "analysing", "done", "failed"
+
+
+class Job:
+    def __init__(self, path, priority=0, name=None, options=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.path = path
+        self.name = name or os.path.splitext(os.path.basename(path))[0]
+        self.priority = priority
+        # Passed through to predict_mbti_from_messages (chunk count, early stopping, ...)
+        self.options = options or {}
+        self.status = QUEUED
+        self.chunks_done = 0
+        self.chunks_total = 0
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.messages = None
+        self.message_counts = None
+        self.result = None
+        self.error = None
+
+    def progress(self, done, total):
+        self.chunks_done = done
+        self.chunks_total = total
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "path": self.path,
+            "priority": self.priority,
+            "status": self.status,
+            "progress": self.chunks_done / self.chunks_total if self.chunks_total else 0.0,
+            "chunks_done": self.chunks_done,
+            "chunks_total": self.chunks_total,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+def summarize_result(result):
+    final_predictions, predictions, letter_counts, significances, chunk_count, message_counts = result
+    return {
+        "mbti": final_predictions,
+        "letter_counts": letter_counts,
+        "interchangeable": significances,
+        "chunks": chunk_count,
+        "message_counts": message_counts,
+    }
+
+
+class JobRunner:
+    def __init__(self, scheduler, cache, output_dir=None, parse_workers=PARSE_WORKERS, max_active=MAX_ACTIVE_JOBS, **options):
+        self.scheduler = scheduler
+        self.cache = cache
+        self.output_dir = output_dir
+        self.parse_workers = parse_workers
+        self.max_active = max_active
+        # Defaults for every job's predict_mbti_from_messages call
+        self.options = options
+        # Jobs still queued or running, and the most recent finished ones
+        self.jobs = {}
+        self.finished = collections.OrderedDict()
+        self.names = set()
+        self.totals = {DONE: 0, FAILED: 0}
+        self.order = itertools.count()
+        self.parse_queue = asyncio.PriorityQueue()
+        # Bounded, so parsing stays only a few jobs ahead of analysis
+        self.analyse_queue = asyncio.PriorityQueue(maxsize=max_active)
+        self.started = time.monotonic()
+        self.pool = None
+        self.tasks = []
+
+    def name_taken(self, name):
+        # Results are written as OUTPUT/<name>.json, so a name is only used once
+        return name in self.names
+
+    def get(self, job_id):
+        return self.jobs.get(job_id) or self.finished.get(job_id)
+
+    def all_jobs(self):
+        return [*self.finished.values(), *self.jobs.values()]
+
+    def submit(self, path, priority=0, name=None, **options):
+        job = Job(path, priority, name, {**self.options, **options})
+        if self.name_taken(job.name):
+            raise ValueError(f"A job named {job.name!r} already exists")
+        self.jobs[job.id] = job
+        self.names.add(job.name)
+        self.parse_queue.put_nowait((-priority, next(self.order), job))
+        instrument.count("jobs_submitted")
+        logger.info(f"Queued job {job.id} ({job.name}, priority {priority})")
+        return job
+
+    def idle(self):
+        return not self.jobs
+
+    def stats(self):
+        counts = {status: 0 for status in (QUEUED, PARSING, PARSED, ANALYSING)}
+        for job in self.jobs.values():
+            counts[job.status] += 1
+        counts.update(self.totals)
+        hours = (time.monotonic() - self.started) / 3600
+        return {
+            "jobs": counts,
+            "chats_per_hour": counts[DONE] / hours if hours else 0.0,
+            "requests": dict(self.scheduler.stats),
+            "cache": self.cache.stats(),
+        }
+
+    async def start(self):
+        from concurrent.futures import ProcessPoolExecutor
+
+        self.pool = ProcessPoolExecutor(self.parse_workers)
+        await self.scheduler.__aenter__()
+        self.tasks = [asyncio.ensure_future(self._parse_worker()) for _ in range(self.parse_workers)]
+        self.tasks += [asyncio.ensure_future(self._analyse_worker()) for _ in range(self.max_active)]
+        self.tasks.append(asyncio.ensure_future(self._report()))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+        await self.scheduler.__aexit__(None, None, None)
+        if self.pool is not None:
+            # Waits for the parses already running, so off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, functools.partial(self.pool.shutdown, cancel_futures=True))
+            self.pool = None
+
+    async def wait_idle(self, interval=0.5):
+        while not self.idle():
+            await asyncio.sleep(interval)
+
+    async def _parse_worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            _, order, job = await self.parse_queue.get()
+            job.status = PARSING
+            job.started = time.time()
+            try:
+                # Serial inside the worker; the pool already parses one job per process
+                job.messages, job.message_counts = await loop.run_in_executor(
+                    self.pool, load_conversations, job.path, None, None, math.inf)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            job.status = PARSED
+            await self.analyse_queue.put((-job.priority, order, job))
+
+    async def _analyse_worker(self):
+        from scheduler import request_priority
+
+        while True:
+            _, _, job = await self.analyse_queue.get()
+            job.status = ANALYSING
+            # Inherited by every chunk task this job starts
+            request_priority.set(job.priority)
+            try:
+                with instrument.span("jobs.analyse", job=job.id):
+                    result = await predict_mbti_from_messages(job.messages, job.message_counts, scheduler=self.scheduler,
+                                                              cache=self.cache, progress=job.progress, **job.options)
+            except Exception as e:
+                self._fail(job, e)
+                continue
+            finally:
+                job.messages = None
+            job.result = summarize_result(result)
+            job.status = DONE
+            job.finished = time.time()
+            instrument.count("jobs_done")
+            instrument.observe("job_seconds", job.finished - job.started)
+            self._write_result(job)
+            self._retire(job)
+            logger.info(f"Finished job {job.id} ({job.name}) in {job.finished - job.started:.1f}s: {job.result['mbti']}")
+
+    def _fail(self, job, error):
+        job.status = FAILED
+        job.error = f"{type(error).__name__}: {error}"
+        job.finished = time.time()
+        job.messages = None
+        instrument.count("jobs_failed")
+        logger.error(f"Job {job.id} ({job.name}) failed: {job.error}")
+        self._write_result(job)
+        self._retire(job)
+
+    def _retire(self, job):
+        # Moves a finished job out of the active set; only the last KEEP_FINISHED are kept in memory
+        self.jobs.pop(job.id, None)
+        self.totals[job.status] += 1
+        self.finished[job.id] = job
+        while len(self.finished) > KEEP_FINISHED:
+            self.finished.popitem(last=False)
+
+    def _write_result(self, job):
+        if not self.output_dir:
+            return
+        path = os.path.join(self.output_dir, f"{job.name}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(job.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(path + ".tmp", path)
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(REPORT_SECONDS)
+            stats = self.stats()
+            active = [job for job in self.jobs.values() if job.status == ANALYSING]
+            logger.info(f"Jobs: {stats['jobs']}, {stats['chats_per_hour']:.0f} chats/hour, requests: {stats['requests']}")
+            for job in active:
+                logger.info(f"  {job.id} ({job.name}, priority {job.priority}): {job.chunks_done}/{job.chunks_total} chunks")
+
+
+async def watch_directory(runner, inbox, priority=0, interval=POLL_SECONDS):
+    # Submit each export once its size has stopped changing between two polls;
+    # exports that already have a result in the output directory are skipped
+    sizes = {}
+    submitted = set()
+    while True:
+        for entry in os.scandir(inbox):
+            if not entry.is_file() or not entry.name.endswith(EXPORT_SUFFIXES) or entry.path in submitted:
+                continue
+            name = os.path.splitext(entry.name)[0]
+            if runner.output_dir and os.path.exists(os.path.join(runner.output_dir, f"{name}.json")):
+                submitted.add(entry.path)
+                continue
+            if runner.name_taken(name):
+                logger.warning(f"Skipping {entry.path}: a job named {name!r} already exists")
+                submitted.add(entry.path)
+                continue
+            size = entry.stat().st_size
+            if sizes.get(entry.path) == size:
+                submitted.add(entry.path)
+                runner.submit(entry.path, priority, name)
+            else:
+                sizes[entry.path] = size
+        await asyncio.sleep(interval)
+
+
+def make_app(runner, spool_dir):
+    # POST /jobs with the export as the body (?priority=&name=), GET /jobs,
+    # GET /jobs/{id} and GET /stats
+    from aiohttp import web
+
+    uploading = set()
+
+    async def submit(request):
+        name = os.path.basename(request.query.get("name", "")) or uuid.uuid4().hex[:12]
+        try:
+            priority = int(request.query.get("priority", 0))
+        except ValueError:
+            raise web.HTTPBadRequest(text="priority must be an integer")
+        path = os.path.join(spool_dir, f"{name}.txt")
+        # Checked before spooling, so a second upload can't overwrite a queued job's export
+        if runner.name_taken(name) or name in uploading or os.path.exists(path):
+            raise web.HTTPConflict(text=f"a job named {name!r} already exists")
+        # Spooled under .part and only moved into place once the whole body is in,
+        # so a cut-off upload leaves nothing behind to block a retry
+        uploading.add(name)
+        try:
+            with open(path + ".part", "wb") as f:
+                async for block in request.content.iter_chunked(1 << 20):
+                    f.write(block)
+            os.replace(path + ".part", path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(path + ".part")
+            raise
+        finally:
+            uploading.discard(name)
+        job = runner.submit(path, priority, name)
+        return web.json_response(job.to_dict(), status=202)
+
+    async def list_jobs(request):
+        return web.json_response([job.to_dict() for job in runner.all_jobs()])
+
+    async def get_job(request):
+        job = runner.get(request.match_info["job_id"])
+        if job is None:
+            raise web.HTTPNotFound()
+        return web.json_response(job.to_dict())
+
+    async def stats(request):
+        return web.json_response(runner.stats())
+
+    app = web.Application(client_max_size=1 << 30)
+    app.router.add_post("/jobs", submit)
+    app.router.add_get("/jobs", list_jobs)
+    app.router.add_get("/jobs/{job_id}", get_job)
+    app.router.add_get("/stats", stats)
+    return app
+
+
+async def serve(args):
+    from scheduler import API_BASE, RequestScheduler
+
+    base_url = API_BASE
+    fake_runner = None
+    if args.fake_api:
+        from fake_openai import start_fake_server
+        fake_runner, _ = await start_fake_server(port=args.fake_api_port, latency=args.fake_latency)
+        base_url = f"http://127.0.0.1:{args.fake_api_port}/v1"
+
+    options = {"target_chunk_count": args.chunks, "early_stopping": args.early_stopping}
+    if args.token_budget:
+        options["token_budget"] = args.token_budget
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    scheduler = RequestScheduler(api_key=openai_api_key or ("fake" if args.fake_api else None), base_url=base_url)
+    cache = LLMCache(args.cache)
+    runner = JobRunner(scheduler, cache, args.output, args.parse_workers, args.max_active, **options)
+    await runner.start()
+
+    inputs = []
+    site_runner = None
+    try:
+        if args.inbox:
+            inputs.append(asyncio.ensure_future(watch_directory(runner, args.inbox, args.priority, args.poll)))
+        if args.port:
+            from aiohttp import web
+            spool_dir = args.spool or os.path.join(args.output or ".", "uploads")
+            os.makedirs(spool_dir, exist_ok=True)
+            site_runner = web.AppRunner(make_app(runner, spool_dir))
+            await site_runner.setup()
+            await web.TCPSite(site_runner, "127.0.0.1", args.port).start()
+            logger.info(f"Accepting jobs on http://127.0.0.1:{args.port}/jobs")
+
+        if args.exit_when_idle:
+            # Give the watcher a couple of polls to find the files that are already there
+            await asyncio.sleep(2 * args.poll + 0.1)
+            await runner.wait_idle()
+        else:
+            await asyncio.Event().wait()
+    finally:
+        for task in inputs:
+            task.cancel()
+        if site_runner is not None:
+            await site_runner.cleanup()
+        logger.info(f"Stats: {runner.stats()}")
+        await runner.stop()
+        cache.close()
+        if fake_runner is not None:
+            await fake_runner.cleanup()
+
+
+def add_arguments(arg_parser):
+    arg_parser.add_argument("--inbox", default=None, help="directory to watch for exports")
+    arg_parser.add_argument("--port", type=int, default=None, help="accept exports over HTTP on this local port")
+    arg_parser.add_argument("--output", default=None, help="directory for per-job result JSON")
+    arg_parser.add_argument("--spool", default=None, help="where uploaded exports are stored (default: OUTPUT/uploads)")
+    arg_parser.add_argument("--priority", type=int, default=0, help="priority of exports from the inbox")
+    arg_parser.add_argument("--poll", type=float, default=POLL_SECONDS)
+    arg_parser.add_argument("--parse-workers", type=int, default=PARSE_WORKERS)
+    arg_parser.add_argument("--max-active", type=int, default=MAX_ACTIVE_JOBS, help="jobs analysed at once")
+    arg_parser.add_argument("--chunks", type=int, default=100, help="target chunk count per job")
+    arg_parser.add_argument("--token-budget", type=int, default=None)
+    arg_parser.add_argument("--early-stopping", action="store_true")
+    arg_parser.add_argument("--cache", default=DEFAULT_CACHE_PATH)
+    arg_parser.add_argument("--exit-when-idle", action="store_true", help="stop once every submitted job has finished")
+    arg_parser.add_argument("--fake-api", action="store_true", help="answer requests from a local fake_openai server")
+    arg_parser.add_argument("--fake-api-port", type=int, default=8091)
+    arg_parser.add_argument("--fake-latency", type=float, default=0.2)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Run MBTI analysis jobs from a directory or a local HTTP endpoint")
+    add_arguments(arg_parser)
+    args = arg_parser.parse_args()
+    if not args.inbox and not args.port:
+        arg_parser.error("give --inbox, --port or both")
+    asyncio.run(serve(args))
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite")
+# Least recently used entries past this count are evicted
+MAX_ENTRIES = 200_000
+# Entries not read or written for this long are evicted
+MAX_AGE_SECONDS = 180 * 24 * 60 * 60
+
+
+def cache_key(model, temperature, prompt):
+    # Content-addressed: the same prompt hits no matter which chunk or file it came from
+    payload = json.dumps([model, temperature, prompt], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=MAX_ENTRIES, max_age=MAX_AGE_SECONDS):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.conn = sqlite3.connect(path)
+        # WAL keeps readers and the per-chunk commits from blocking each other
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions ("
+            "key TEXT PRIMARY KEY, model TEXT, value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS completions_accessed ON completions (accessed_at)")
+        self.conn.commit()
+        self.evict()
+
+    def get(self, key):
+        row = self.conn.execute("SELECT value FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE completions SET accessed_at = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, key, value, model=None):
+        # Committed straight away so a crash only loses in-flight chunks
+        now = time.time()
+        self.conn.execute(
+            "INSERT OR REPLACE INTO completions (key, model, value, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, model, value, now, now),
+        )
+        self.conn.commit()
+        self.writes += 1
+
+    def evict(self):
+        expired = self.conn.execute("DELETE FROM completions WHERE accessed_at < ?", (time.time() - self.max_age,)).rowcount
+        overflow = self.conn.execute(
+            "DELETE FROM completions WHERE key IN "
+            "(SELECT key FROM completions ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        self.conn.commit()
+        if expired or overflow:
+            logger.info(f"Evicted {expired} expired and {overflow} least recently used cache entries")
+
+    def __contains__(self, key):
+        # Unlike get(), leaves the hit/miss stats and recency alone
+        return self.conn.execute("SELECT 1 FROM completions WHERE key = ?", (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(self),
+        }
+
+    def close(self):
+        self.evict()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,131 @@
+import argparse
+import json
+import logging
+from collections import Counter
+
+from llm_cache import cache_key
+from personality import (MODEL, TEMPERATURE, create_adaptive_chunks, encode_prompt, estimate_request_plan,
+                         load_conversations, parse_prediction_lines, summarize_predictions)
+from prompts import decode_prediction
+
+logger = logging.getLogger(__name__)
+
+# Offline alternative to predict_mbti_from_chat: write every chunk prompt to a
+# batch request file, run it through the batch API, then aggregate the results
+# file. Both files are streamed line by line. Compact prompts use participant
+# aliases, so their legends go to a sidecar file next to the requests, which
+# import needs to map the replies back to names.
+
+BATCH_URL = "/v1/chat/completions"
+
+
+def aliases_path(requests_path):
+    return requests_path + ".aliases.jsonl"
+
+
+def custom_id(index, chunk, prompt):
+    # Stable across re-exports of the same chat with the same chunking
+    start, end = chunk
+    return f"chunk-{index:06d}-{start}-{end}-{cache_key(MODEL, TEMPERATURE, prompt)[:16]}"
+
+
+def export_batch_requests(file_path, output_path, target_chunk_count=100, min_messages_per_participant=3,
+                          message_range=None, token_budget=None, workers=None):
+    messages, message_counts = load_conversations(file_path, message_range, workers)
+    chunks = create_adaptive_chunks(messages, target_chunk_count, min_messages_per_participant, token_budget)
+    plan = estimate_request_plan(messages, chunks)
+
+    with open(output_path, "w", encoding="utf-8") as f, open(aliases_path(output_path), "w", encoding="utf-8") as legend:
+        for index, chunk in enumerate(chunks):
+            prompt, aliases = encode_prompt(messages, *chunk)
+            request_id = custom_id(index, chunk, prompt)
+            if aliases:
+                legend.write(json.dumps({"custom_id": request_id, "aliases": aliases}, ensure_ascii=False) + "\n")
+            request = {
+                "custom_id": request_id,
+                "method": "POST",
+                "url": BATCH_URL,
+                "body": {
+                    "model": MODEL,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": TEMPERATURE,
+                },
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+    logger.info(f"Wrote {plan['requests']} requests (~{plan['prompt_tokens']} prompt tokens) to {output_path}")
+    return plan
+
+
+def iter_batch_results(results_path):
+    # (custom_id, content) for every successful line; failed lines come back with content None
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            response = result.get("response") or {}
+            body = response.get("body") or {}
+            if result.get("error") or response.get("status_code", 200) != 200 or "choices" not in body:
+                yield result.get("custom_id"), None
+                continue
+            yield result.get("custom_id"), body["choices"][0]["message"]["content"]
+
+
+def load_aliases(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return {entry["custom_id"]: entry["aliases"] for entry in (json.loads(line) for line in f if line.strip())}
+
+
+def import_batch_results(results_path, aliases_file=None):
+    # Only per-participant type tallies are kept, so memory doesn't grow with the number of chunks
+    legends = load_aliases(aliases_file) if aliases_file else {}
+    type_counts = {}
+    succeeded = 0
+    failed = []
+    for request_id, content in iter_batch_results(results_path):
+        if content is None:
+            failed.append(request_id)
+            continue
+        succeeded += 1
+        content = decode_prediction(content, legends.get(request_id))
+        for participant, mbti in parse_prediction_lines(content):
+            type_counts.setdefault(participant, Counter())[mbti] += 1
+
+    if failed:
+        logger.warning(f"{len(failed)} batch requests failed, first few: {failed[:5]}")
+    final_predictions, letter_counts, significances = summarize_predictions(
+        {participant: counts.elements() for participant, counts in type_counts.items()}
+    )
+    logger.info(f"Aggregated {succeeded} chunk results from {results_path}")
+    return final_predictions, type_counts, letter_counts, significances, succeeded, failed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Batch-API workflow for MBTI analysis")
+    subcommands = arg_parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subcommands.add_parser("export", help="write chunk prompts as a batch request JSONL file")
+    export_parser.add_argument("chat_file")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--chunks", type=int, default=100, help="target chunk count")
+    export_parser.add_argument("--token-budget", type=int, default=None, help="size chunks by prompt tokens instead")
+    export_parser.add_argument("--min-messages", type=int, default=3)
+
+    import_parser = subcommands.add_parser("import", help="aggregate a batch results JSONL file")
+    import_parser.add_argument("results")
+    import_parser.add_argument("--aliases", default=None, help="the .aliases.jsonl file written next to the exported requests")
+
+    args = arg_parser.parse_args()
+    if args.command == "export":
+        plan = export_batch_requests(args.chat_file, args.output, args.chunks, args.min_messages, token_budget=args.token_budget)
+        print(f"{plan['requests']} requests, ~{plan['prompt_tokens']} prompt tokens -> {args.output} (aliases: {aliases_path(args.output)})")
+    else:
+        final_predictions, type_counts, letter_counts, significances, succeeded, failed = import_batch_results(args.results, args.aliases)
+        print(f"Aggregated {succeeded} chunks ({len(failed)} failed)")
+        for participant, mbti in final_predictions.items():
+            print(f"{participant}: {mbti}")
+            print(f"  Letter Counts: {letter_counts[participant]}")
+            if significances[participant]:
+                print(f"  Undecided: {', '.join(significances[participant])}")
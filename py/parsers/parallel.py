@@ -0,0 +1,41 @@
+import logging
+import os
+
+from parsers.reader import ExportLines, find_head
+
+logger = logging.getLogger(__name__)
+
+# Below this size the pool costs more than it saves
+PARALLEL_THRESHOLD_BYTES = 64 * 1024 * 1024
+# More shards than workers so one slow shard doesn't leave the other cores idle
+SHARDS_PER_WORKER = 4
+
+
+def shard_spans(path, is_head, shards):
+    # Byte ranges that each start on a line for which is_head(line) is true, so no
+    # multi-line message is ever split across two shards
+    size = os.path.getsize(path)
+    cuts = [0]
+    for k in range(1, shards):
+        target = max(size * k // shards, cuts[-1])
+        position = find_head(path, target, is_head)
+        if cuts[-1] < position < size:
+            cuts.append(position)
+    cuts.append(size)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def read_span(path, start, end):
+    # Lines of one shard, decoded as they're consumed
+    return ExportLines(path, start, end)
+
+
+def map_shards(path, is_head, worker, args=(), workers=None):
+    # Run worker((path, start, end) + args) over every shard, results in file order
+    workers = workers or os.cpu_count() or 1
+    spans = shard_spans(path, is_head, workers * SHARDS_PER_WORKER)
+    logger.info(f"Parsing {path} in {len(spans)} shards on {workers} processes")
+    # Imported here: multiprocessing is a large share of the parser's import time
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(worker, [(path, start, end) + tuple(args) for start, end in spans]))
@@ -0,0 +1,92 @@
+import io
+import logging
+import mmap
+import os
+
+logger = logging.getLogger(__name__)
+
+# Memory-mapped reader for chat exports. The file is mapped, cut into
+# newline-aligned blocks with byte-level searches, and each block is decoded
+# only when the parser gets to it, so the decoded export never exists in memory
+# at once. Pages behind the read position are handed back to the OS, which
+# keeps resident memory at a few blocks however large the export is.
+#
+# Lines come out exactly as iterating open(path, encoding="utf-8") would give
+# them (universal newlines, line endings kept), except that a leading BOM is
+# dropped and invalid UTF-8 is replaced with U+FFFD instead of raising.
+
+BLOCK_SIZE = 1 << 20
+BOM = b"\xef\xbb\xbf"
+
+
+def _release(mapped, start, end):
+    # Drop the pages of an already-read range; they're file-backed, so this only costs a re-read if revisited
+    if not hasattr(mmap, "MADV_DONTNEED"):
+        return
+    start -= start % mmap.PAGESIZE
+    end -= end % mmap.PAGESIZE
+    if end > start:
+        mapped.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def iter_blocks(path, start=0, end=None, block_size=BLOCK_SIZE):
+    # Raw byte blocks of [start, end), each ending just after a newline (or at end)
+    size = os.path.getsize(path)
+    end = size if end is None else min(end, size)
+    if start >= end:
+        return
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        if start == 0 and mapped[:len(BOM)] == BOM:
+            start = len(BOM)
+        position = previous = start
+        while position < end:
+            cut = min(position + block_size, end)
+            if cut < end:
+                newline = mapped.find(b"\n", cut - 1, end)
+                cut = end if newline == -1 else newline + 1
+            # The previous block has been consumed by the time the next one is asked for
+            _release(mapped, previous, position)
+            previous = position
+            yield mapped[position:cut]
+            position = cut
+
+
+def iter_lines(path, start=0, end=None, errors="replace", block_size=BLOCK_SIZE):
+    replaced = 0
+    for block in iter_blocks(path, start, end, block_size):
+        text = block.decode("utf-8", errors)
+        if "\ufffd" in text:
+            replaced += text.count("\ufffd")
+        yield from io.StringIO(text, newline=None)
+    if replaced:
+        logger.warning(f"Replaced {replaced} undecodable bytes in {path}")
+
+
+class ExportLines:
+    # Re-iterable lines of an export; every iteration maps the file afresh
+    def __init__(self, path, start=0, end=None, errors="replace"):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.errors = errors
+
+    def __iter__(self):
+        return iter_lines(self.path, self.start, self.end, self.errors)
+
+
+def find_head(path, position, is_head, end=None):
+    # Offset of the first line at or after the line following `position` for
+    # which is_head(line) holds, or the end of the file. Only the scanned lines are decoded.
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        size = len(mapped) if end is None else min(end, len(mapped))
+        newline = mapped.find(b"\n", position, size)
+        position = size if newline == -1 else newline + 1
+        while position < size:
+            newline = mapped.find(b"\n", position, size)
+            line_end = size if newline == -1 else newline + 1
+            if is_head(mapped[position:line_end].decode("utf-8", "replace")):
+                return position
+            position = line_end
+        return size
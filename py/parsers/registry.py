@@ -0,0 +1,117 @@
+import json
+import logging
+import os
+import re
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+REGEXES_PATH = os.path.join(os.path.dirname(__file__), "regexes.json")
+FINGERPRINTS_PATH = os.path.join(os.path.dirname(__file__), "fingerprints.json")
+
+# Same bar good_regex uses: the pattern has to account for 70% of the sample
+MATCH_THRESHOLD = 0.7
+
+_LEADING_NON_LETTERS = re.compile(r'[^A-Za-z]*')
+_DIGIT_RUN = re.compile(r'\d+')
+_LINE_MARKS = "\ufeff\u200e"
+
+
+def line_shape(line):
+    # "[7/29/24, 3:06:05 PM] Andrew: hi" -> "[0/0/0, 0:0:0 "
+    head = _LEADING_NON_LETTERS.match(line.lstrip(_LINE_MARKS)).group()
+    return _DIGIT_RUN.sub('0', head)[:32]
+
+
+def fingerprint(lines):
+    # The most common timestamp-like line prefix in the sample identifies the export format
+    shapes = Counter(line_shape(line) for line in lines if line.strip())
+    for shape, _ in shapes.most_common():
+        if '0' in shape:
+            return shape
+    return None
+
+
+class FormatRegistry:
+    def __init__(self, regexes_path=REGEXES_PATH, fingerprints_path=FINGERPRINTS_PATH):
+        self.regexes_path = regexes_path
+        self.fingerprints_path = fingerprints_path
+        with open(regexes_path, "r") as f:
+            self.patterns = json.load(f)
+        if os.path.exists(fingerprints_path):
+            with open(fingerprints_path, "r") as f:
+                self.fingerprints = json.load(f)
+        else:
+            self.fingerprints = {}
+        self.hits = Counter()
+        self._compiled = {}
+
+    def compiled(self, pattern):
+        regex = self._compiled.get(pattern)
+        if regex is None:
+            regex = self._compiled[pattern] = re.compile(pattern)
+        return regex
+
+    def score(self, pattern, lines, threshold=0.0):
+        # Fraction of sample characters covered by lines the pattern matches.
+        # Gives up as soon as the threshold is out of reach.
+        regex = self.compiled(pattern)
+        total = sum(len(line) for line in lines)
+        if total == 0:
+            return 0.0
+        needed = threshold * total
+        matched = 0
+        remaining = total
+        for line in lines:
+            remaining -= len(line)
+            match = regex.match(line.lstrip(_LINE_MARKS))
+            if match:
+                matched += match.end()
+            if matched + remaining < needed:
+                break
+        return matched / total
+
+    def detect(self, lines):
+        lines = [line.rstrip("\r\n") for line in lines]
+        key = fingerprint(lines)
+
+        pattern = self.fingerprints.get(key)
+        if pattern and self.score(pattern, lines, MATCH_THRESHOLD) >= MATCH_THRESHOLD:
+            self.hits[pattern] += 1
+            return pattern
+
+        # Try the patterns that have matched most often first
+        candidates = sorted(self.patterns, key=lambda p: -self.hits[p])
+        for pattern in candidates:
+            if self.score(pattern, lines, MATCH_THRESHOLD) >= MATCH_THRESHOLD:
+                self.hits[pattern] += 1
+                self.remember(key, pattern)
+                return pattern
+        return None
+
+    def remember(self, key, pattern):
+        if key is None or self.fingerprints.get(key) == pattern:
+            return
+        logger.info(f"Remembering format fingerprint {key!r}")
+        self.fingerprints[key] = pattern
+        with open(self.fingerprints_path, "w") as f:
+            f.write(json.dumps(self.fingerprints, indent=4))
+
+    def add(self, pattern, lines=None):
+        if pattern not in self.patterns:
+            self.patterns.append(pattern)
+            with open(self.regexes_path, "w") as f:
+                f.write(json.dumps(self.patterns, indent=4))
+        if lines is not None:
+            self.remember(fingerprint([line.rstrip("\r\n") for line in lines]), pattern)
+
+
+_registry = None
+
+
+def get_registry():
+    # One registry per process so patterns are only loaded and compiled once
+    global _registry
+    if _registry is None:
+        _registry = FormatRegistry()
+    return _registry
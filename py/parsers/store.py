@@ -0,0 +1,173 @@
+from array import array
+from datetime import datetime, timezone
+
+import numpy as np
+
+from parsers import universal
+from parsers.universal import parse_records
+
+_EPOCH = datetime(1970, 1, 1)
+_SECOND = datetime(1970, 1, 1, 0, 0, 1) - _EPOCH
+
+
+def to_epoch(date):
+    if date.tzinfo is not None:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+    return (date - _EPOCH) // _SECOND
+
+
+def from_epoch(seconds):
+    return _EPOCH + seconds * _SECOND
+
+
+class MessageStore:
+    # Columnar message storage: interned user ids, epoch-second timestamps and all
+    # message text in one UTF-8 buffer. offsets[i]:offsets[i + 1] is message i's text.
+    # Slices share the underlying arrays.
+
+    def __init__(self, users, user_ids, timestamps, text, offsets):
+        self.users = users
+        self.user_ids = user_ids
+        self.timestamps = timestamps
+        self.text = text
+        self.offsets = offsets
+
+    @classmethod
+    def from_records(cls, records):
+        # records are (user, message, date) tuples, e.g. from parse_records
+        users = []
+        user_index = {}
+        user_ids = array('i')
+        timestamps = array('q')
+        offsets = array('q', [0])
+        text = bytearray()
+        for user, message, date in records:
+            user_id = user_index.get(user)
+            if user_id is None:
+                user_id = user_index[user] = len(users)
+                users.append(user)
+            user_ids.append(user_id)
+            timestamps.append(to_epoch(date))
+            text += message.encode('utf-8')
+            offsets.append(len(text))
+        return cls(
+            users,
+            np.frombuffer(user_ids, dtype=np.int32),
+            np.frombuffer(timestamps, dtype=np.int64),
+            np.frombuffer(bytes(text), dtype=np.uint8),
+            np.frombuffer(offsets, dtype=np.int64),
+        )
+
+    @classmethod
+    def from_messages(cls, messages):
+        return cls.from_records((m.user, m.message, m.date) for m in messages)
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return self.take(np.arange(start, stop, step))
+            return self.slice(start, stop)
+        if index < 0:
+            index += len(self)
+        return self.message(index)
+
+    def slice(self, start, stop):
+        stop = max(start, stop)
+        return MessageStore(
+            self.users,
+            self.user_ids[start:stop],
+            self.timestamps[start:stop],
+            self.text,
+            self.offsets[start:stop + 1],
+        )
+
+    @property
+    def is_sorted(self):
+        return bool(np.all(self.timestamps[1:] >= self.timestamps[:-1]))
+
+    def between(self, start, end):
+        # Messages with start <= date < end. Exports in time order come back as a
+        # view; out-of-order exports fall back to a copy.
+        if isinstance(start, datetime):
+            start = to_epoch(start)
+        if isinstance(end, datetime):
+            end = to_epoch(end)
+        if self.is_sorted:
+            lo, hi = np.searchsorted(self.timestamps, [start, end], side='left')
+            return self.slice(int(lo), int(hi))
+        return self.take(np.flatnonzero((self.timestamps >= start) & (self.timestamps < end)))
+
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        # Gather every selected byte in one shot
+        gather = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1])
+        return MessageStore(
+            self.users,
+            self.user_ids[indices],
+            self.timestamps[indices],
+            self.text[gather],
+            offsets,
+        )
+
+    def message_text(self, index):
+        return self.text[self.offsets[index]:self.offsets[index + 1]].tobytes().decode('utf-8')
+
+    def texts(self):
+        buffer = self.text[self.offsets[0]:self.offsets[-1]].tobytes() if len(self) else b''
+        base = int(self.offsets[0]) if len(self) else 0
+        bounds = (self.offsets - base).tolist()
+        for i in range(len(self)):
+            yield buffer[bounds[i]:bounds[i + 1]].decode('utf-8')
+
+    def user(self, index):
+        return self.users[self.user_ids[index]]
+
+    def message(self, index):
+        return universal.Message(user=self.user(index), message=self.message_text(index), date=from_epoch(int(self.timestamps[index])))
+
+    def to_messages(self):
+        return [
+            universal.Message(user=self.users[user_id], message=text, date=from_epoch(timestamp))
+            for user_id, text, timestamp in zip(self.user_ids.tolist(), self.texts(), self.timestamps.tolist())
+        ]
+
+    def pairs(self):
+        # (sender, message) tuples in the shape personality.extract_conversations produces
+        return list(zip((self.users[user_id] for user_id in self.user_ids.tolist()), self.texts()))
+
+    def text_lengths(self):
+        return np.diff(self.offsets)
+
+    def message_counts(self):
+        return np.bincount(self.user_ids, minlength=len(self.users))
+
+    def word_counts(self):
+        # Whitespace-separated words per message, counted on the raw UTF-8 buffer
+        if not len(self):
+            return np.zeros(0, dtype=np.int64)
+        lo, hi = int(self.offsets[0]), int(self.offsets[-1])
+        is_space = np.isin(self.text[lo:hi], np.frombuffer(b' \t\n\r\x0b\x0c', dtype=np.uint8))
+        starts_word = ~is_space
+        starts_word[1:] &= is_space[:-1]
+        # A message's first byte always starts a word if it isn't whitespace
+        bounds = self.offsets - lo
+        firsts = bounds[:-1][bounds[:-1] < hi - lo]
+        starts_word[firsts] = ~is_space[firsts]
+        cumulative = np.concatenate(([0], np.cumsum(starts_word, dtype=np.int64)))
+        return cumulative[bounds[1:]] - cumulative[bounds[:-1]]
+
+    def buckets(self, seconds):
+        # Bucket index per message, e.g. buckets(86400) for days since the epoch
+        return self.timestamps // seconds
+
+
+def parse_columnar(source, pattern=None):
+    return MessageStore.from_records(parse_records(source, pattern))
@@ -0,0 +1,158 @@
+import logging
+import re
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Candidate layouts, most likely first. Month-first comes before day-first so an
+# ambiguous export decodes the same way dateutil.parser.parse would.
+DATE_LAYOUTS = ['%m/%d/%y', '%m/%d/%Y', '%d/%m/%y', '%d/%m/%Y', '%Y-%m-%d', '%Y/%m/%d', '%d.%m.%y', '%d.%m.%Y', '%d-%m-%Y']
+TIME_LAYOUTS = ['%I:%M:%S %p', '%I:%M %p', '%H:%M:%S', '%H:%M']
+SEPARATORS = [', ', ' ']
+
+# Regex fragments for each directive. %p accepts "PM", "pm", "p.m." and friends,
+# and spaces accept the narrow no-break spaces newer WhatsApp exports use.
+_DIRECTIVES = {
+    'm': r'(?P<month>\d{1,2})',
+    'd': r'(?P<day>\d{1,2})',
+    'y': r'(?P<year2>\d{2})',
+    'Y': r'(?P<year>\d{4})',
+    'H': r'(?P<hour>\d{1,2})',
+    'I': r'(?P<hour12>\d{1,2})',
+    'M': r'(?P<minute>\d{2})',
+    'S': r'(?P<second>\d{2})',
+    'p': r'(?P<ampm>[AaPp])\.?\s?[Mm]\.?',
+}
+
+# Memo entries kept per decoder before it is reset
+MEMO_SIZE = 1 << 16
+
+
+def _layout_regex(layout):
+    out = []
+    i = 0
+    while i < len(layout):
+        char = layout[i]
+        if char == '%':
+            out.append(_DIRECTIVES[layout[i + 1]])
+            i += 2
+            continue
+        if char == ' ':
+            # "7:07 p.m." and "7:07p.m." both show up
+            out.append(r'\s?' if layout[i + 1:i + 3] == '%p' else r'\s+')
+        else:
+            out.append(re.escape(char))
+        i += 1
+    return re.compile(''.join(out))
+
+
+def _full_year(year2, now_year=datetime.now().year):
+    # Same two-digit year rule dateutil uses: pick the century within 50 years of today
+    year = year2 + now_year // 100 * 100
+    if year >= now_year + 50:
+        year -= 100
+    elif year < now_year - 50:
+        year += 100
+    return year
+
+
+def dateutil_parse(raw):
+    # dateutil is only imported once something actually needs it
+    from dateutil import parser
+    return parser.parse(raw)
+
+
+class TimestampDecoder:
+    def __init__(self, layout):
+        self.layout = layout
+        self.regex = _layout_regex(layout)
+        self.has_seconds = '%S' in layout
+        self.memo = {}
+        self.fallbacks = 0
+
+    def _minute(self, groups):
+        if groups['year'] is not None:
+            year = int(groups['year'])
+        else:
+            year = _full_year(int(groups['year2']))
+        if groups.get('hour12') is not None:
+            hour = int(groups['hour12']) % 12
+            if groups['ampm'] in 'Pp':
+                hour += 12
+        else:
+            hour = int(groups['hour'])
+        return datetime(year, int(groups['month']), int(groups['day']), hour, int(groups['minute']))
+
+    def decode(self, raw):
+        raw = raw.strip()
+        match = self.regex.fullmatch(raw)
+        if match is None:
+            return self._fallback(raw)
+
+        # Every message sent in the same minute shares everything but the seconds
+        if self.has_seconds:
+            start, end = match.span('second')
+            key = raw[:start] + raw[end:]
+        else:
+            key = raw
+        minute = self.memo.get(key)
+        if minute is None:
+            groups = match.groupdict()
+            groups.setdefault('year', None)
+            try:
+                minute = self._minute(groups)
+            except ValueError:
+                return self._fallback(raw)
+            if len(self.memo) >= MEMO_SIZE:
+                self.memo.clear()
+            self.memo[key] = minute
+        if self.has_seconds:
+            return minute.replace(second=int(match.group('second')))
+        return minute
+
+    def _fallback(self, raw):
+        self.fallbacks += 1
+        return dateutil_parse(raw)
+
+    def __call__(self, raw):
+        return self.decode(raw)
+
+
+class DateutilDecoder:
+    # Used when no known layout fits the sample
+    layout = None
+    fallbacks = 0
+
+    def __call__(self, raw):
+        return dateutil_parse(raw)
+
+    decode = __call__
+
+
+def infer_layout(samples):
+    samples = [s.strip() for s in samples if s and s.strip()]
+    if not samples:
+        return None
+    for date_layout in DATE_LAYOUTS:
+        for separator in SEPARATORS:
+            for time_layout in TIME_LAYOUTS:
+                layout = date_layout + separator + time_layout
+                decoder = TimestampDecoder(layout)
+                if all(decoder.regex.fullmatch(s) for s in samples):
+                    try:
+                        for s in samples:
+                            decoder.decode(s)
+                    except (ValueError, OverflowError):
+                        continue
+                    if decoder.fallbacks == 0:
+                        return layout
+    return None
+
+
+def decoder_for(samples):
+    layout = infer_layout(samples)
+    if layout is None:
+        logger.info("No fixed timestamp layout fits this export, falling back to dateutil")
+        return DateutilDecoder()
+    logger.info(f"Decoding timestamps with layout {layout!r}")
+    return TimestampDecoder(layout)
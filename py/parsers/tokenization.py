@@ -0,0 +1,134 @@
+import gc
+import re
+from contextlib import contextmanager
+
+# Shared text cleaning and tokenization. Batch functions join many messages into
+# one buffer so each pass runs once per batch instead of once per message.
+
+# Emoji blocks, symbols and dingbats (U+2600-27BF), flags, and the variation
+# selector and zero-width joiner that glue multi-part emoji together
+EMOJI_CLASS = ("[\U0001F600-\U0001F64F\U0001F300-\U0001F5FF\U0001F680-\U0001F6FF\U0001F1E0-\U0001F1FF"
+               "\U0001F900-\U0001FAFF\u2600-\u27BF\uFE0F\u200D]")
+URL = re.compile(r"(?:http|www)\S+")
+URL_OR_EMOJI = re.compile(rf"(?:http|www)\S+|{EMOJI_CLASS}+")
+NON_WORD = re.compile(r"[^a-z0-9\s]")
+
+# tokenize_many lowercases and drops non-word characters on the UTF-8 bytes
+# (bytes.lower, then one bytes.translate), much faster than str.lower and
+# NON_WORD over the whole buffer. Every non-ASCII character is dropped, so the
+# multi-byte characters \s counts as whitespace are turned into spaces first,
+# and the two whose lowercase is ASCII are rewritten up front.
+_ASCII_LOWERCASE = {"\u0130": "i", "\u212a": "k"}
+_UNICODE_SPACE = re.compile(rb"\xc2[\x85\xa0]|\xe1\x9a\x80|\xe2\x80[\x80-\x8a\xa8\xa9\xaf]|\xe2\x81\x9f|\xe3\x80\x80")
+_WORD_BYTES = frozenset(b"abcdefghijklmnopqrstuvwxyz0123456789\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f ")
+_NON_WORD_BYTES = bytes(byte for byte in range(256) if byte not in _WORD_BYTES)
+
+# ASCII record separator: counts as whitespace, so URLs and words never run across it
+SEPARATOR = "\x1e"
+
+STOP_WORDS = frozenset("""
+a about after all also am an and any are as at be because been but by can could did do does
+dont for from get got had has have he her him his how i im if in into is it its ill ive just
+like me my no not of oh ok on or our out so that thats the their them then there they this to
+too up us was we were what when which who will with would yeah yes you your
+""".split())
+
+
+def clean(text):
+    return URL_OR_EMOJI.sub('', text)
+
+
+def _split_batch(buffer, count):
+    parts = buffer.split(SEPARATOR)
+    return parts if len(parts) == count else None
+
+
+def clean_many(texts):
+    texts = list(texts)
+    parts = _split_batch(URL_OR_EMOJI.sub('', SEPARATOR.join(texts)), len(texts))
+    if parts is None:
+        # A message contained the separator itself
+        return [clean(text) for text in texts]
+    return parts
+
+
+@contextmanager
+def _gc_paused():
+    # Building hundreds of thousands of small lists otherwise triggers repeated full
+    # collections that cost more than the tokenizing itself. Only ever wraps the
+    # list comprehension itself, which allocates no cycles.
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def ngrams(tokens, n):
+    return [" ".join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+
+
+def _finish(tokens, stop_words, ngram):
+    if stop_words:
+        tokens = [token for token in tokens if token not in stop_words]
+    if ngram > 1:
+        tokens = ngrams(tokens, ngram)
+    return tokens
+
+
+def tokenize(message, stop_words=None, ngram=1):
+    # Drop URLs, lowercase, drop everything but [a-z0-9] and whitespace, split on whitespace
+    return _finish(NON_WORD.sub('', URL.sub('', message).lower()).split(), stop_words, ngram)
+
+
+def _strip_non_words(buffer):
+    # NON_WORD.sub('', buffer.lower())
+    for char, lowercase in _ASCII_LOWERCASE.items():
+        if char in buffer:
+            buffer = buffer.replace(char, lowercase)
+    encoded = _UNICODE_SPACE.sub(b" ", buffer.encode("utf-8", "surrogatepass"))
+    return encoded.lower().translate(None, _NON_WORD_BYTES).decode("ascii")
+
+
+def tokenize_many(messages, stop_words=None, ngram=1):
+    # Same tokens as tokenize() on each message, so callers needn't clean_many first
+    messages = list(messages)
+    parts = _split_batch(_strip_non_words(URL.sub('', SEPARATOR.join(messages))), len(messages))
+    if parts is None:
+        return [tokenize(message, stop_words, ngram) for message in messages]
+    if stop_words or ngram > 1:
+        return [_finish(part.split(), stop_words, ngram) for part in parts]
+    with _gc_paused():
+        tokens = [part.split() for part in parts]
+    return tokens
+
+
+class Vocabulary:
+    # Interns tokens as consecutive ints so counters downstream hash ints, not strings
+
+    def __init__(self):
+        self.ids = {}
+        self.words = []
+
+    def __len__(self):
+        return len(self.words)
+
+    def encode(self, tokens):
+        ids = self.ids
+        encoded = []
+        for token in tokens:
+            token_id = ids.get(token)
+            if token_id is None:
+                token_id = ids[token] = len(self.words)
+                self.words.append(token)
+            encoded.append(token_id)
+        return encoded
+
+    def encode_many(self, token_lists):
+        with _gc_paused():
+            return [self.encode(tokens) for tokens in token_lists]
+
+    def decode(self, token_ids):
+        return [self.words[token_id] for token_id in token_ids]
@@ -1,33 +1,56 @@
-from openai import OpenAI
+import functools
+import itertools
 import os 
 import re 
-import json 
 import logging 
-from pydantic import BaseModel
 from datetime import datetime
-from dateutil import parser
+import instrument
+from parsers.parallel import PARALLEL_THRESHOLD_BYTES, map_shards, read_span
+from parsers.reader import iter_lines
+from parsers.registry import get_registry
+from parsers.timestamps import DateutilDecoder, TimestampDecoder, decoder_for
+from parsers.tokenization import clean, clean_many
 
-
-# Set up OpenAI API key
-client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-)
-
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class RegexResponse(BaseModel):
-    user1: str
-    user2: str
-    regex_pattern: str
-
-class Message(BaseModel):
-    user: str 
-    message: str
-    date: datetime
-
-def clean(text):
-    return re.sub(r'http\S+|www\S+|https\S+|\U0001F600-\U0001F64F|\U0001F300-\U0001F5FF|\U0001F680-\U0001F6FF|\U0001F1E0-\U0001F1FF', '', text, flags=re.MULTILINE)
+# Format detection only looks at the head of an export
+SAMPLE_LINES = 200
+SAMPLE_CHARS = 64 * 1024
+# Continuation lines past this size are dropped so one runaway message can't exhaust memory
+MAX_MESSAGE_CHARS = 64 * 1024
+
+# pydantic and the OpenAI SDK take most of a second to import, so they're only
+# loaded when a Message is built or the LLM is asked for a pattern
+@functools.lru_cache(maxsize=None)
+def _models():
+    from pydantic import BaseModel
+
+    class RegexResponse(BaseModel):
+        user1: str
+        user2: str
+        regex_pattern: str
+
+    class Message(BaseModel):
+        user: str 
+        message: str
+        date: datetime
+
+    for model in (RegexResponse, Message):
+        model.__module__ = __name__
+        model.__qualname__ = model.__name__
+    # Later lookups go straight to the module globals instead of __getattr__
+    globals().update(RegexResponse=RegexResponse, Message=Message)
+    return {"RegexResponse": RegexResponse, "Message": Message}
+
+def __getattr__(name):
+    if name in ("RegexResponse", "Message"):
+        return _models()[name]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+@functools.lru_cache(maxsize=None)
+def get_client():
+    from openai import OpenAI
+    return OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 def get_parsing_info_from_llm(content_sample):
     logger.info("Requesting parsing information from LLM")
@@ -58,55 +81,149 @@ def get_parsing_info_from_llm(content_sample):
     "(?P<timestamp>\\d{4}-\\d{2}-\\d{2},\\s\\d{1,2}:\\d{2}\\s(?:AM|PM))\\s-\\s(?P<user>[^:]+):\\s(?P<message>.*)"
     """
 
-    response = client.beta.chat.completions.parse(
+    response = get_client().beta.chat.completions.parse(
         model="gpt-4o-2024-08-06",
         messages=[
             {"role": "system", "content": "You are a helpful assistant that analyzes chat transcripts."},
             {"role": "user", "content": prompt}
         ],
-        response_format=RegexResponse,
+        response_format=_models()["RegexResponse"],
         temperature=0
     )
 
     return response.choices[0].message.parsed
 
-def good_regex(content, regex):
-    matches = re.findall(regex, content, re.MULTILINE)
-    # find the total length 
-    all_text = " ".join([" ".join(match) for match in matches]) 
-    if len(all_text) > 0.7 * len(content):
-        return True
-    return False
-    
+@instrument.traced("universal.detect_pattern")
+def detect_pattern(lines):
+    registry = get_registry()
+    pattern = registry.detect(lines)
+    if pattern:
+        return pattern
+    logger.info("No regex pattern matched the chat transcript, using LLM")
+    instrument.count("pattern_llm_requests")
+    pattern = get_parsing_info_from_llm("".join(lines)[:3000]).regex_pattern
+    registry.add(pattern, lines)
+    return pattern
+
+@instrument.traced("universal.parse")
 def parse(chat_text):
-    regexes = json.load(open("parsers/regexes.json", "r"))
-    # find one that matches 
-    pattern = None 
-    for regex in regexes:
-        if good_regex(chat_text, regex):
-            pattern = regex
-            break
-    if not pattern:
-        logger.info("No regex pattern matched the chat transcript, using LLM")
-        pattern = get_parsing_info_from_llm(chat_text[:3000]).regex_pattern
+    sample = chat_text[:SAMPLE_CHARS].splitlines(keepends=True)[:SAMPLE_LINES]
+    pattern = detect_pattern(sample)
 
+    decode = decoder_for(sample_timestamps(sample, pattern))
+
+    Message = _models()["Message"]
     matches = re.finditer(pattern, chat_text, re.MULTILINE)
     parsed_data = []
     for match in matches:
         if match:
             groups = match.groupdict()
-            timestamp = parser.parse(groups['timestamp'])
+            timestamp = decode(groups['timestamp'])
             user = groups['user']
             message = clean(groups['message'])
             parsed_data.append(Message(user=user, message=message, date=timestamp))
-    regexes.append(pattern)
-    regexes = list(set(regexes))
-    with open("parsers/regexes.json", "w") as f:
-        f.write(json.dumps(regexes, indent=4)) 
+    instrument.count("chars_read", len(chat_text))
+    instrument.count("messages_parsed", len(parsed_data))
     return parsed_data
 
+def read_prefix(lines, max_lines=SAMPLE_LINES, max_chars=SAMPLE_CHARS):
+    # Pull a bounded sample off the front of a line iterator for format detection
+    prefix = []
+    size = 0
+    for line in lines:
+        prefix.append(line)
+        size += len(line)
+        if len(prefix) >= max_lines or size >= max_chars:
+            break
+    return prefix
+
+def iter_records(lines, pattern, max_message_chars=MAX_MESSAGE_CHARS):
+    # Group lines into (timestamp, user, message) records. Lines that don't start
+    # a new message are continuation lines of the previous one.
+    regex = get_registry().compiled(pattern)
+    current = None
+    parts = []
+    size = 0
+    for line in lines:
+        line = line.rstrip("\r\n")
+        # WhatsApp prefixes attachment/system lines with a left-to-right mark
+        match = regex.match(line.lstrip("\ufeff\u200e"))
+        if match:
+            if current:
+                yield current[0], current[1], "\n".join(parts)
+            groups = match.groupdict()
+            current = (groups['timestamp'], groups['user'])
+            parts = [groups['message']]
+            size = len(parts[0])
+        elif current and size < max_message_chars:
+            parts.append(line)
+            size += len(line) + 1
+    if current:
+        yield current[0], current[1], "\n".join(parts)
+
+def sample_timestamps(lines, pattern):
+    return [timestamp for timestamp, _, _ in iter_records(lines, pattern)]
+
+def parse_records(source, pattern=None, max_message_chars=MAX_MESSAGE_CHARS):
+    # source is a file path or an open text stream; (user, message, date) tuples are yielded lazily
+    if isinstance(source, (str, os.PathLike)):
+        instrument.count("bytes_read", os.path.getsize(source))
+        yield from parse_records(iter_lines(source), pattern, max_message_chars)
+        return
+
+    lines = iter(source)
+    prefix = read_prefix(lines)
+    if not pattern:
+        pattern = detect_pattern(prefix)
+    decode = decoder_for(sample_timestamps(prefix, pattern))
+
+    # Counted once at the end, not per record, to stay cheap when instrumentation is off
+    parsed = 0
+    try:
+        for timestamp, user, message in iter_records(itertools.chain(prefix, lines), pattern, max_message_chars):
+            yield user, clean(message), decode(timestamp)
+            parsed += 1
+    finally:
+        instrument.count("messages_parsed", parsed)
+
+def parse_stream(source, pattern=None, max_message_chars=MAX_MESSAGE_CHARS):
+    Message = _models()["Message"]
+    for user, message, date in parse_records(source, pattern, max_message_chars):
+        yield Message(user=user, message=message, date=date)
+
+def _parse_shard(job):
+    path, start, end, pattern, layout = job
+    decode = TimestampDecoder(layout) if layout else DateutilDecoder()
+    records = list(iter_records(read_span(path, start, end), pattern))
+    messages = clean_many(message for _, _, message in records)
+    return [(user, message, decode(timestamp)) for (timestamp, user, _), message in zip(records, messages)]
+
+@instrument.traced("universal.parse_parallel")
+def parse_parallel(path, pattern=None, workers=None, threshold=PARALLEL_THRESHOLD_BYTES):
+    # Same records as list(parse_records(path)), parsed across a process pool
+    prefix = read_prefix(iter_lines(path))
+    if not pattern:
+        pattern = detect_pattern(prefix)
+
+    if os.path.getsize(path) < threshold:
+        return list(parse_records(path, pattern))
+
+    # Every shard has to decode with the layout the serial path would infer from the head
+    layout = decoder_for(sample_timestamps(prefix, pattern)).layout
+    regex = get_registry().compiled(pattern)
+
+    def is_head(line):
+        return regex.match(line.rstrip("\r\n").lstrip("\ufeff\u200e")) is not None
+
+    shards = map_shards(path, is_head, _parse_shard, (pattern, layout), workers)
+    records = list(itertools.chain.from_iterable(shards))
+    instrument.count("bytes_read", os.path.getsize(path))
+    instrument.count("messages_parsed", len(records))
+    return records
+
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     content = open("files/kai.txt").read()
     for i in parse(content)[-30:]:
         print(i)
\ No newline at end of file
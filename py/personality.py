@@ -1,78 +1,94 @@
 import asyncio
-import json
+import itertools
 import logging
 import math
 import os
+import random
 import re
 import time
-from collections import Counter, defaultdict
+from collections import Counter
 
-import aiohttp
-import nest_asyncio
-from scipy.stats import binomtest
+import instrument
+from llm_cache import DEFAULT_CACHE_PATH, LLMCache, cache_key
+from parsers.parallel import PARALLEL_THRESHOLD_BYTES, map_shards, read_span
+from parsers.reader import ExportLines
+from prompts import compact_prompt, decode_prediction, estimate_compact_message_tokens, verbose_prompt
+from tokens import estimate_message_tokens, estimate_tokens
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 openai_api_key = os.getenv("API_KEY")
 
+MODEL = "gpt-4o-mini"
+TEMPERATURE = 0
+# Expected reply size, only used for rate limiting
+RESPONSE_TOKENS = 50
+# Aliased, merged and trimmed chunk prompts (see prompts.py), opt-in with COMPACT_PROMPTS=1 until their
+# agreement with the original format has been measured on the real model (benchmarks/bench_prompt.py --base-url)
+COMPACT_PROMPTS = os.getenv("COMPACT_PROMPTS", "0") != "0"
+# Early stopping treats an axis as decided once the votes favour one letter over
+# a model that picks it this often over one that's guessing
+SPRT_ALTERNATIVE = 0.75
+
+# Regular expressions for different date formats
+CHAT_PATTERNS = [
+    r'\[(\d{1,2}/\d{1,2}/\d{2,4},\s+\d{1,2}:\d{2}:\d{2}\s+[AP]M)\]\s+([^:]+):\s+(.*)',  # Format 1
+    r'(\d{2}/\d{2}/\d{4},\s+\d{2}:\d{2})\s+-\s+([^:]+):\s+(.*)',  # Format 2
+    r'(\d{4}-\d{2}-\d{2},\s+\d{1,2}:\d{2}\s+[ap]\.m\.)\s+-\s+([^:]+):\s+(.*)'  # Format 3
+]
+# One alternation tried in the same order as the list above
+CHAT_HEADER = re.compile("|".join(f"(?:{pattern})" for pattern in CHAT_PATTERNS))
+
+SYSTEM_SENDERS = frozenset(["Les messages et les appels sont chiffrés de bout en bout.", "Messages and calls are end-to-end encrypted."])
+
 def read_whatsapp_chat(file_path):
-    logger.info(f"Reading WhatsApp chat from {file_path}")
-    start_time = time.time()
-    with open(file_path, 'r', encoding='utf-8') as file:
-        chat_lines = file.readlines()
-    logger.info(f"Read {len(chat_lines)} lines in {time.time() - start_time:.2f} seconds")
-    return chat_lines
+    # Lines are decoded from a memory map as extract_conversations consumes them,
+    # rather than the whole export being read into a list up front. Not traced:
+    # the reading and decoding time shows up under extract_conversations.
+    size = os.path.getsize(file_path)
+    logger.info(f"Reading WhatsApp chat from {file_path} ({size} bytes)")
+    instrument.count("bytes_read", size)
+    return ExportLines(file_path)
 
-def extract_conversations(chat_lines, message_range=None):
-    logger.info("Extracting conversations from chat lines")
-    start_time = time.time()
-    messages = []
-    message_counts = defaultdict(int)
+def iter_conversation(chat_lines):
+    # Yield (sender, message) pairs in one pass, joining continuation lines and
+    # dropping system notices as they're seen
     current_sender = None
-    current_message = ""
-
-    # Regular expressions for different date formats
-    patterns = [
-        r'\[(\d{1,2}/\d{1,2}/\d{2,4},\s+\d{1,2}:\d{2}:\d{2}\s+[AP]M)\]\s+([^:]+):\s+(.*)',  # Format 1
-        r'(\d{2}/\d{2}/\d{4},\s+\d{2}:\d{2})\s+-\s+([^:]+):\s+(.*)',  # Format 2
-        r'(\d{4}-\d{2}-\d{2},\s+\d{1,2}:\d{2}\s+[ap]\.m\.)\s+-\s+([^:]+):\s+(.*)'  # Format 3
-    ]
+    parts = []
 
     for line in chat_lines:
-        matched = False
-        for pattern in patterns:
-            match = re.match(pattern, line)
-            if match:
-                if current_sender and current_message:
-                    messages.append((current_sender, current_message.strip()))
-                    message_counts[current_sender] += 1
-                
-                if len(match.groups()) == 3:
-                    _, current_sender, current_message = match.groups()
-                else:
-                    current_sender, current_message = match.groups()[1:]
-                
-                matched = True
-                break
-        
-        if not matched:
-            current_message += " " + line.strip()
+        match = CHAT_HEADER.match(line)
+        if match is None:
+            if current_sender is not None:
+                parts.append(line.strip())
+            continue
 
-    if current_sender and current_message:
-        messages.append((current_sender, current_message.strip()))
-        message_counts[current_sender] += 1
+        if current_sender is not None and (parts[0] or len(parts) > 1) and current_sender not in SYSTEM_SENDERS:
+            yield current_sender, " ".join(parts).strip()
 
-    # Remove system messages and empty senders
-    messages = [(sender, msg) for sender, msg in messages if sender and sender not in ["Les messages et les appels sont chiffrés de bout en bout.", "Messages and calls are end-to-end encrypted."]]
+        # The last group of whichever alternative matched is the message, the one before it the sender
+        index = match.lastindex
+        current_sender = match.group(index - 1)
+        parts = [match.group(index)]
 
-    if message_range:
-        messages = messages[message_range[0]:message_range[1]]
-        # Recalculate message counts for the range
-        message_counts = defaultdict(int)
-        for sender, _ in messages:
-            message_counts[sender] += 1
+    if current_sender is not None and (parts[0] or len(parts) > 1) and current_sender not in SYSTEM_SENDERS:
+        yield current_sender, " ".join(parts).strip()
+
+@instrument.traced("personality.extract_conversations")
+def extract_conversations(chat_lines, message_range=None):
+    logger.info("Extracting conversations from chat lines")
+    start_time = time.time()
+
+    conversation = iter_conversation(chat_lines)
+    if message_range and all(bound is not None and bound >= 0 for bound in message_range):
+        # Skip to the range and stop reading once it's filled
+        messages = list(itertools.islice(conversation, message_range[0], message_range[1]))
+    elif message_range:
+        messages = list(conversation)[message_range[0]:message_range[1]]
+    else:
+        messages = list(conversation)
+    message_counts = Counter(sender for sender, _ in messages)
+    instrument.count("messages_extracted", len(messages))
 
     logger.info(f"Extracted {len(messages)} messages in {time.time() - start_time:.2f} seconds")
     logger.info(f"Message counts per participant: {dict(message_counts)}")
@@ -83,11 +99,50 @@ def extract_conversations(chat_lines, message_range=None):
 
     return messages, dict(message_counts)
 
+def is_message_start(line):
+    return CHAT_HEADER.match(line) is not None
+
+def _extract_shard(job):
+    path, start, end = job
+    return extract_conversations(read_span(path, start, end))
+
+@instrument.traced("personality.extract_conversations_parallel")
+def extract_conversations_parallel(file_path, message_range=None, workers=None):
+    # Same output as extract_conversations(read_whatsapp_chat(file_path), message_range),
+    # with the file split at message boundaries and extracted across a process pool
+    logger.info(f"Extracting conversations from {file_path} in parallel")
+    start_time = time.time()
+    messages = []
+    message_counts = {}
+    for shard_messages, shard_counts in map_shards(file_path, is_message_start, _extract_shard, workers=workers):
+        messages.extend(shard_messages)
+        for sender, count in shard_counts.items():
+            message_counts[sender] = message_counts.get(sender, 0) + count
+
+    if message_range:
+        messages = messages[message_range[0]:message_range[1]]
+        message_counts = dict(Counter(sender for sender, _ in messages))
+
+    logger.info(f"Extracted {len(messages)} messages in {time.time() - start_time:.2f} seconds")
+    return messages, message_counts
+
+def load_conversations(file_path, message_range=None, workers=None, parallel_threshold=PARALLEL_THRESHOLD_BYTES):
+    if os.path.getsize(file_path) >= parallel_threshold:
+        return extract_conversations_parallel(file_path, message_range, workers)
+    chat_lines = read_whatsapp_chat(file_path)
+    return extract_conversations(chat_lines, message_range)
+
 def log_progress(current, total, message):
+    # INFO at every 10%, so a 10k-chunk run doesn't write 10k progress lines
     percent = (current / total) * 100
-    logger.info(f"{message}: {percent:.2f}% ({current}/{total})")
+    step = max(total // 10, 1)
+    level = logging.INFO if current == total or current % step == 0 else logging.DEBUG
+    logger.log(level, f"{message}: {percent:.2f}% ({current}/{total})")
 
-def create_adaptive_chunks(messages, target_chunk_count=100, min_messages_per_participant=3):
+@instrument.traced("personality.create_adaptive_chunks")
+def create_adaptive_chunks(messages, target_chunk_count=100, min_messages_per_participant=3, token_budget=None):
+    if token_budget:
+        return create_token_chunks(messages, token_budget, min_messages_per_participant)
     logger.info(f"Creating adaptive chunks with target count of {target_chunk_count}")
     start_time = time.time()
     total_messages = len(messages)
@@ -120,48 +175,112 @@ def create_adaptive_chunks(messages, target_chunk_count=100, min_messages_per_pa
     logger.info(f"Created {len(chunks)} chunks in {time.time() - start_time:.2f} seconds")
     return chunks
 
+@instrument.traced("personality.create_token_chunks")
+def create_token_chunks(messages, token_budget, min_messages_per_participant=3, message_tokens=None):
+    # Pack consecutive messages until the estimated prompt reaches token_budget
+    logger.info(f"Creating token-budget chunks of up to {token_budget} prompt tokens")
+    start_time = time.time()
+    if message_tokens is None:
+        message_tokens = prompt_message_tokens(messages)
+    budget = max(token_budget - estimate_tokens(create_prompt(messages, 0, 0)), 1)
+    total_messages = len(messages)
+    chunks = []
+
+    start = 0
+    while start < total_messages:
+        end = start
+        used = 0
+        participant_counts = {}
+        while end < total_messages and (end == start or used + message_tokens[end] <= budget):
+            sender = messages[end][0]
+            participant_counts[sender] = participant_counts.get(sender, 0) + 1
+            used += message_tokens[end]
+            end += 1
+
+        # Go over budget, by at most another budget's worth, so every participant
+        # in the chunk has enough messages to be judged on
+        extension = 0
+        while end < total_messages and extension < budget and any(count < min_messages_per_participant for count in participant_counts.values()):
+            sender = messages[end][0]
+            participant_counts[sender] = participant_counts.get(sender, 0) + 1
+            extension += message_tokens[end]
+            end += 1
+
+        chunks.append((start, end))
+        start = end
+
+    logger.info(f"Created {len(chunks)} chunks in {time.time() - start_time:.2f} seconds")
+    return chunks
+
+def estimate_request_plan(messages, chunks, message_tokens=None):
+    # Estimated prompt tokens per request, computed before anything is sent
+    if message_tokens is None:
+        message_tokens = prompt_message_tokens(messages)
+    cumulative = list(itertools.accumulate(message_tokens, initial=0))
+    overhead = estimate_tokens(create_prompt(messages, 0, 0))
+    chunk_tokens = [overhead + cumulative[end] - cumulative[start] for start, end in chunks]
+    return {
+        "requests": len(chunks),
+        "prompt_tokens": sum(chunk_tokens),
+        "max_prompt_tokens": max(chunk_tokens, default=0),
+        "mean_prompt_tokens": sum(chunk_tokens) / len(chunks) if chunks else 0,
+    }
+
+def prompt_message_tokens(messages):
+    # Estimated prompt tokens each message adds in the current prompt format
+    if COMPACT_PROMPTS:
+        return estimate_compact_message_tokens(messages)
+    return estimate_message_tokens(messages)
+
+def encode_prompt(messages, start, end):
+    # (prompt, aliases); decode_prediction(reply, aliases) maps the reply back to participant names
+    if COMPACT_PROMPTS:
+        return compact_prompt(messages[start:end])
+    return verbose_prompt(messages[start:end]), {}
+
 def create_prompt(messages, start, end):
-    prompt = "Analyze the following WhatsApp conversation chunk and predict the MBTI personality types of the participants. Provide only the MBTI type for each participant:\n\n"
-    for sender, message in messages[start:end]:
-        prompt += f"{sender}: {message}\n"
-    prompt += "\nBased on these messages, what are the likely MBTI types of each participant? Provide only the MBTI type for each participant."
-    return prompt
+    return encode_prompt(messages, start, end)[0]
 
-async def process_chunk(session, chunk, messages, cache, chunk_number, total_chunks):
+@instrument.traced("personality.process_chunk")
+async def process_chunk(scheduler, chunk, messages, cache, chunk_number, total_chunks):
     start, end = chunk
-    cache_key = f"{start}_{end}"
+    prompt, aliases = encode_prompt(messages, start, end)
+    key = cache_key(MODEL, TEMPERATURE, prompt)
     
-    if cache_key in cache:
-        logger.info(f"Cache hit for chunk {chunk_number}/{total_chunks} ({start}-{end})")
-        return cache[cache_key]
+    cached = cache.get(key)
+    if cached is not None:
+        instrument.count("cache_hits")
+        logger.debug(f"Cache hit for chunk {chunk_number}/{total_chunks} ({start}-{end})")
+        return cached
+    instrument.count("cache_misses")
     
-    logger.info(f"Processing chunk {chunk_number}/{total_chunks} ({start}-{end})")
-    chunk_start_time = time.time()
-    prompt = create_prompt(messages, start, end)
-    
-    logger.info(f"Sending chunk {chunk_number}/{total_chunks} to OpenAI API")
-    api_call_start = time.time()
+    logger.debug(f"Sending chunk {chunk_number}/{total_chunks} ({start}-{end}) to OpenAI API")
+    api_call_start = time.perf_counter()
+    # Prompt size plus room for the reply, charged against the tokens-per-minute budget
+    prompt_tokens = estimate_tokens(prompt)
+    instrument.count("prompt_tokens_sent", prompt_tokens)
     try:
-        async with session.post('https://api.openai.com/v1/chat/completions', json={
-            "model": "gpt-4o-mini",
+        result = await scheduler.chat_completion({
+            "model": MODEL,
             "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0
-        }, headers={"Authorization": f"Bearer {openai_api_key}"}) as response:
-            result = await response.json()
-            api_call_duration = time.time() - api_call_start
-            logger.info(f"Received response for chunk {chunk_number}/{total_chunks} in {api_call_duration:.2f} seconds")
-            
-            if 'choices' not in result:
-                logger.error(f"Unexpected API response for chunk {chunk_number}/{total_chunks}: {result}")
-                return f"API Error: Unexpected response format for chunk {start}-{end}"
-            
-            prediction = result['choices'][0]['message']['content']
+            "temperature": TEMPERATURE
+        }, tokens=prompt_tokens + RESPONSE_TOKENS)
+        api_call_duration = time.perf_counter() - api_call_start
+        instrument.observe("chunk_latency_seconds", api_call_duration)
+        logger.debug(f"Received response for chunk {chunk_number}/{total_chunks} in {api_call_duration:.2f} seconds")
+        
+        if 'choices' not in result:
+            instrument.count("api_errors")
+            logger.error(f"Unexpected API response for chunk {chunk_number}/{total_chunks}: {result}")
+            return f"API Error: Unexpected response format for chunk {start}-{end}"
+        
+        prediction = decode_prediction(result['choices'][0]['message']['content'], aliases)
     except Exception as e:
+        instrument.count("api_errors")
         logger.error(f"API call failed for chunk {chunk_number}/{total_chunks}: {str(e)}")
         return f"API Error: {str(e)} for chunk {start}-{end}"
     
-    cache[cache_key] = prediction
-    logger.info(f"Processed chunk {chunk_number}/{total_chunks} in {time.time() - chunk_start_time:.2f} seconds")
+    cache.put(key, prediction, MODEL)
     return prediction
 
 def count_mbti_letters(mbti_list):
@@ -176,6 +295,8 @@ def is_significant_difference(count1, count2, alpha=0.3):
     total = count1 + count2
     if total == 0:
         return False
+    # scipy is slow to import and only needed once the votes are in
+    from scipy.stats import binomtest
     result = binomtest(count1, total, p=0.5)
     return result.pvalue < alpha
 
@@ -196,75 +317,203 @@ def determine_final_mbti_with_significance(letter_counts):
     
     return final_mbti, significance
 
-async def predict_mbti_from_chat(file_path, target_chunk_count=100, min_messages_per_participant=3, message_range=None):
-    overall_start_time = time.time()
-    
-    chat_lines = read_whatsapp_chat(file_path)
-    messages, message_counts = extract_conversations(chat_lines, message_range)
-    
-    chunks = create_adaptive_chunks(messages, target_chunk_count, min_messages_per_participant)
-      
-    cache_file = f"{file_path}_cache.json"
-    if os.path.exists(cache_file):
-        with open(cache_file, 'r') as f:
-            cache = json.load(f)
-        logger.info(f"Loaded cache with {len(cache)} entries")
-    else:
-        cache = {}
-        logger.info("No existing cache found")
-    
-    async with aiohttp.ClientSession() as session:
-        logger.info("Starting asynchronous processing of chunks")
-        tasks = [process_chunk(session, chunk, messages, cache, i+1, len(chunks)) for i, chunk in enumerate(chunks)]
-        chunk_predictions = []
-        for i, task in enumerate(asyncio.as_completed(tasks)):
-            try:
-                result = await task
-                if result.startswith("API Error:"):
-                    logger.warning(f"Skipping error chunk: {result}")
-                else:
-                    chunk_predictions.append(result)
-            except Exception as e:
-                logger.error(f"Error processing chunk {i+1}: {str(e)}")
-            log_progress(i+1, len(tasks), "Processing chunks")
-    
-    with open(cache_file, 'w') as f:
-        json.dump(cache, f)
-    logger.info(f"Updated cache file with {len(cache)} entries")
-    
-    logger.info("Processing predictions")
+def parse_prediction_lines(prediction):
+    # "Participant: MBTI" lines from one chunk's response
+    for line in prediction.split('\n'):
+        if ':' in line:
+            parts = line.split(':')
+            if len(parts) != 2:
+                continue
+            yield parts[0].strip(), parts[1].strip()
+
+def collect_predictions(chunk_predictions):
     predictions = {}
     for chunk_prediction in chunk_predictions:
-        for line in chunk_prediction.split('\n'):
-            if ':' in line:
-                participant, mbti = line.split(':')
-                participant = participant.strip()
-                mbti = mbti.strip()
-                if participant not in predictions:
-                    predictions[participant] = []
-                predictions[participant].append(mbti)
-    
-    logger.info("Calculating final predictions and significances")
+        for participant, mbti in parse_prediction_lines(chunk_prediction):
+            if participant not in predictions:
+                predictions[participant] = []
+            predictions[participant].append(mbti)
+    return predictions
+
+def summarize_predictions(predictions):
+    # predictions maps each participant to an iterable of per-chunk MBTI strings
     final_predictions = {}
     letter_counts = {}
     significances = {}
     for participant, mbti_list in predictions.items():
         letter_counts[participant] = count_mbti_letters(mbti_list)
         final_predictions[participant], significances[participant] = determine_final_mbti_with_significance(letter_counts[participant])
+    return final_predictions, letter_counts, significances
+
+@instrument.traced("personality.run_chunks")
+async def run_chunks(scheduler, messages, chunks, cache, progress=None):
+    # progress(done, total) is called as each chunk finishes
+    logger.info("Starting asynchronous processing of chunks")
+    tasks = [process_chunk(scheduler, chunk, messages, cache, i+1, len(chunks)) for i, chunk in enumerate(chunks)]
+    chunk_predictions = []
+    for i, task in enumerate(asyncio.as_completed(tasks)):
+        try:
+            result = await task
+            if result.startswith("API Error:"):
+                logger.warning(f"Skipping error chunk: {result}")
+            else:
+                chunk_predictions.append(result)
+        except Exception as e:
+            logger.error(f"Error processing chunk {i+1}: {str(e)}")
+        log_progress(i+1, len(tasks), "Processing chunks")
+        if progress:
+            progress(i+1, len(tasks))
+    return chunk_predictions
+
+def stratified_order(chunk_count, strata=10, seed=0):
+    # Shuffle chunks within equal slices of the timeline, then deal the slices out
+    # round-robin so every prefix of the order samples the whole chat
+    rng = random.Random(seed)
+    strata = max(1, min(strata, chunk_count))
+    groups = [list(range(i * chunk_count // strata, (i + 1) * chunk_count // strata)) for i in range(strata)]
+    for group in groups:
+        rng.shuffle(group)
+    rng.shuffle(groups)
+    return [index for deal in itertools.zip_longest(*groups) for index in deal if index is not None]
+
+def is_axis_decided(count_a, count_b, confidence=0.95, alternative=SPRT_ALTERNATIVE):
+    # Wald's sequential probability ratio test of p = 0.5 against p = alternative,
+    # in whichever direction the votes currently lean
+    majority = max(count_a, count_b)
+    minority = min(count_a, count_b)
+    log_ratio = majority * math.log(alternative / 0.5) + minority * math.log((1 - alternative) / 0.5)
+    return log_ratio >= math.log(confidence / (1 - confidence))
+
+def all_axes_decided(letter_counts, confidence=0.95, participants=None):
+    # Every participant has to have votes, so one quickly decided sender can't end the run for everyone
+    pairs = [('E', 'I'), ('N', 'S'), ('T', 'F'), ('J', 'P')]
+    if participants is not None and not set(participants) <= set(letter_counts):
+        return False
+    return bool(letter_counts) and all(
+        is_axis_decided(counts[a], counts[b], confidence) for counts in letter_counts.values() for a, b in pairs
+    )
+
+@instrument.traced("personality.run_chunks_adaptive")
+async def run_chunks_adaptive(scheduler, messages, chunks, cache, participants, confidence=0.95, max_requests=None, seed=0, progress=None):
+    # Dispatch chunks in stratified random order and stop as soon as every
+    # participant's four axes pass the sequential test (or max_requests is hit)
+    order = stratified_order(len(chunks), seed=seed)
+    limit = min(len(order), max_requests or len(order))
+    window = getattr(scheduler, "max_concurrency", 16)
+    logger.info(f"Starting adaptive processing of up to {limit} of {len(chunks)} chunks")
+
+    chunk_predictions = []
+    letter_counts = {}
+    in_flight = set()
+    dispatched = 0
+    completed = 0
+    decided = False
+    while not decided and (dispatched < limit or in_flight):
+        while not decided and dispatched < limit and len(in_flight) < window:
+            index = order[dispatched]
+            dispatched += 1
+            in_flight.add(asyncio.ensure_future(process_chunk(scheduler, chunks[index], messages, cache, dispatched, limit)))
+        done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+        completed += len(done)
+        if progress:
+            progress(completed, limit)
+        for task in done:
+            try:
+                result = task.result()
+            except Exception as e:
+                logger.error(f"Error processing chunk: {str(e)}")
+                continue
+            if result.startswith("API Error:"):
+                logger.warning(f"Skipping error chunk: {result}")
+                continue
+            chunk_predictions.append(result)
+            for participant, mbti in parse_prediction_lines(result):
+                # Names the model made up don't get a say in when to stop
+                if participant in participants:
+                    counts = letter_counts.setdefault(participant, count_mbti_letters([]))
+                    for letter, count in count_mbti_letters([mbti]).items():
+                        counts[letter] += count
+        decided = all_axes_decided(letter_counts, confidence, participants)
+
+    if in_flight:
+        # Already paid for, so keep their results
+        for result in await asyncio.gather(*in_flight, return_exceptions=True):
+            if isinstance(result, str) and not result.startswith("API Error:"):
+                chunk_predictions.append(result)
+
+    reason = "all axes decided" if decided else "request cap reached" if dispatched < len(chunks) else "all chunks processed"
+    # Skipped chunks already in the cache would not have cost a call anyway
+    saved = sum(cache_key(MODEL, TEMPERATURE, encode_prompt(messages, *chunks[index])[0]) not in cache for index in order[dispatched:])
+    logger.info(f"Adaptive processing used {dispatched}/{len(chunks)} chunks ({reason}), saved {saved} API calls")
+    return chunk_predictions
+
+@instrument.traced("personality.predict_mbti_from_chat")
+async def predict_mbti_from_chat(file_path, target_chunk_count=100, min_messages_per_participant=3, message_range=None, workers=None, cache_path=DEFAULT_CACHE_PATH, scheduler=None, token_budget=None,
+                                 early_stopping=False, confidence=0.95, max_requests=None, seed=0, cache=None, progress=None):
+    overall_start_time = time.time()
+    
+    messages, message_counts = load_conversations(file_path, message_range, workers)
+    result = await predict_mbti_from_messages(messages, message_counts, target_chunk_count, min_messages_per_participant, cache_path, scheduler, token_budget,
+                                              early_stopping, confidence, max_requests, seed, cache, progress)
     
     logger.info(f"Total processing time: {time.time() - overall_start_time:.2f} seconds")
+    return result
+
+@instrument.traced("personality.predict_mbti_from_messages")
+async def predict_mbti_from_messages(messages, message_counts, target_chunk_count=100, min_messages_per_participant=3, cache_path=DEFAULT_CACHE_PATH, scheduler=None, token_budget=None,
+                                     early_stopping=False, confidence=0.95, max_requests=None, seed=0, cache=None, progress=None):
+    # Chunk and analyse already extracted messages. A cache or scheduler passed in
+    # is shared with the caller and left open.
+    message_tokens = prompt_message_tokens(messages)
+    if token_budget:
+        chunks = create_token_chunks(messages, token_budget, min_messages_per_participant, message_tokens)
+    else:
+        chunks = create_adaptive_chunks(messages, target_chunk_count, min_messages_per_participant)
+    plan = estimate_request_plan(messages, chunks, message_tokens)
+    logger.info(f"Request plan: {plan['requests']} requests, ~{plan['prompt_tokens']} prompt tokens (largest ~{plan['max_prompt_tokens']})")
+      
+    owns_cache = cache is None
+    if owns_cache:
+        cache = LLMCache(cache_path)
+        logger.info(f"Opened cache {cache_path} with {len(cache)} entries")
+    
+    try:
+        if scheduler is None:
+            # aiohttp is only loaded by runs that actually send requests
+            from scheduler import RequestScheduler
+            scheduler = RequestScheduler(api_key=openai_api_key)
+        async with scheduler:
+            if early_stopping:
+                # Senders with too few messages to show up in a chunk's reply would never let the run stop
+                participants = {sender for sender, count in message_counts.items() if count >= min_messages_per_participant}
+                chunk_predictions = await run_chunks_adaptive(scheduler, messages, chunks, cache, participants or set(message_counts),
+                                                              confidence, max_requests, seed, progress)
+            else:
+                chunk_predictions = await run_chunks(scheduler, messages, chunks, cache, progress)
+        logger.info(f"Cache stats: {cache.stats()}")
+        logger.info(f"Request stats: {scheduler.stats}")
+    finally:
+        if owns_cache:
+            cache.close()
+    
+    logger.info("Processing predictions")
+    predictions = collect_predictions(chunk_predictions)
+    
+    logger.info("Calculating final predictions and significances")
+    final_predictions, letter_counts, significances = summarize_predictions(predictions)
+    
     return final_predictions, predictions, letter_counts, significances, len(chunks), message_counts
 
-async def run_analysis():
-    chat_file_path = '_chat.txt'  # Replace with your actual file path
-    message_range = None  # Set to None to process all messages, or use a tuple like (0, 3000) for the first 3000 messages
+async def run_analysis(chat_file_path='_chat.txt', message_range=None, target_chunk_count=100, min_messages_per_participant=3, **options):
+    # message_range: None for all messages, or a tuple like (0, 3000) for the first 3000
     try:
         logger.info("Starting MBTI prediction process")
         final_predictions, all_predictions, letter_counts, significances, chunk_count, message_counts = await predict_mbti_from_chat(
             chat_file_path, 
-            target_chunk_count=100, 
-            min_messages_per_participant=3, 
-            message_range=message_range
+            target_chunk_count=target_chunk_count, 
+            min_messages_per_participant=min_messages_per_participant, 
+            message_range=message_range,
+            **options
         )
         
         if not final_predictions:
@@ -310,8 +559,13 @@ async def run_analysis():
         logger.error(f"An error occurred: {e}", exc_info=True)
         print(f"An error occurred: {e}")
 
-# Apply nest_asyncio to allow running asyncio in Jupyter
-nest_asyncio.apply()
+if __name__ == "__main__":
+    import nest_asyncio
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    # Apply nest_asyncio to allow running asyncio in Jupyter
+    nest_asyncio.apply()
 
-# Run the analysis
-asyncio.get_event_loop().run_until_complete(run_analysis())
\ No newline at end of file
+    # Run the analysis
+    asyncio.get_event_loop().run_until_complete(run_analysis())
@@ -0,0 +1,114 @@
+import re
+
+from tokens import estimate_tokens
+
+# Chunk prompt formats. The verbose format is the original one: every message on
+# its own line under the sender's full name. The compact format spends the
+# tokens on what the messages say instead:
+# - participants get one- or two-letter aliases, listed once in a legend, and the
+#   aliases in the reply are mapped back to names by decode_prediction
+# - consecutive messages from one sender share a line, joined with " / "
+# - URLs shrink to their domain, media placeholders to [media], and WhatsApp
+#   notices, invisible marks and runs of whitespace are dropped
+
+VERBOSE_HEADER = "Analyze the following WhatsApp conversation chunk and predict the MBTI personality types of the participants. Provide only the MBTI type for each participant:\n\n"
+VERBOSE_FOOTER = "\nBased on these messages, what are the likely MBTI types of each participant? Provide only the MBTI type for each participant."
+
+COMPACT_HEADER = "Predict the MBTI personality type of each participant in this WhatsApp conversation chunk. Participants\n"
+COMPACT_INTRO = "\nConsecutive messages from one participant are joined with \" / \".\n\n"
+COMPACT_FOOTER = "\nReply with only one line per participant, alias then type, like \"A: INTP\"."
+MESSAGE_JOINER = " / "
+
+_URL = re.compile(r"(?:https?://|www\.)([^/\s?#]+)\S*", re.IGNORECASE)
+_MEDIA = re.compile(
+    r"<(?:Media omitted|Médias omis|attached: [^>]*)>"
+    r"|\b(?:image|video|audio|sticker|GIF|document|Contact card) omitted\b"
+    r"|\bimage absente\b|\bvidéo absente\b",
+    re.IGNORECASE,
+)
+_EDITED = re.compile(r"\s*<(?:This message was edited|Ce message a été modifié)>")
+_DELETED = re.compile(r"^(?:This message was deleted|You deleted this message|Ce message a été supprimé|Vous avez supprimé ce message)\.?$")
+_INVISIBLE = re.compile("[\u200e\u200f\u202a-\u202e\u2066-\u2069\ufeff]")
+_SPACE = re.compile(r"\s+")
+# WhatsApp marks its own notices (encryption, contact cards, calls) with a leading U+200E
+_NOTICE_MARK = "\u200e"
+_PARTICIPANT = re.compile(r"^[\s*\-•]*(.*?)[\s*]*$")
+_ALIAS_WITH_NAME = re.compile(r"^([A-Z]{1,2})\s*[(\[]")
+
+
+def verbose_prompt(messages):
+    lines = [f"{sender}: {message}\n" for sender, message in messages]
+    return "".join([VERBOSE_HEADER, *lines, VERBOSE_FOOTER])
+
+
+def compact_text(message):
+    # The message as the compact format sends it, or "" for a notice that carries no signal
+    notice = message.startswith(_NOTICE_MARK)
+    message = _MEDIA.sub("[media]", _EDITED.sub("", message))
+    message = _URL.sub(lambda match: f"<{match.group(1).lower().removeprefix('www.')}>", message)
+    message = _SPACE.sub(" ", _INVISIBLE.sub("", message)).strip()
+    if _DELETED.match(message):
+        return "[deleted]"
+    if notice and message != "[media]":
+        return ""
+    return message
+
+
+def alias_for(index):
+    # A..Z, then AA, AB, ...
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord("A") + remainder) + letters
+    return letters
+
+
+def compact_prompt(messages):
+    # (prompt, aliases); aliases maps each alias used in the prompt to its participant
+    aliases = {}
+    names = {}
+    lines = []
+    current = None
+    for sender, message in messages:
+        text = compact_text(message)
+        if not text:
+            continue
+        if sender not in names:
+            names[sender] = alias_for(len(names))
+            aliases[names[sender]] = sender
+        if sender == current:
+            lines[-1].append(text)
+        else:
+            current = sender
+            lines.append([f"{names[sender]}: {text}"])
+    legend = [f"{alias} = {name}\n" for alias, name in aliases.items()]
+    body = [MESSAGE_JOINER.join(parts) + "\n" for parts in lines]
+    return "".join([COMPACT_HEADER, *legend, COMPACT_INTRO, *body, COMPACT_FOOTER]), aliases
+
+
+def decode_prediction(prediction, aliases):
+    # Rewrite "A: INTP" reply lines as "Name: INTP", so they parse like verbose-format replies.
+    # Also copes with "A (Name): INTP" and with the model answering with the names themselves.
+    if not aliases:
+        return prediction
+    names = set(aliases.values())
+    decoded = []
+    for line in prediction.split("\n"):
+        participant, colon, mbti = line.partition(":")
+        if not colon:
+            decoded.append(line)
+            continue
+        participant = _PARTICIPANT.match(participant).group(1)
+        if participant not in names:
+            with_name = _ALIAS_WITH_NAME.match(participant)
+            alias = with_name.group(1) if with_name else participant
+            participant = aliases.get(alias, participant)
+        decoded.append(f"{participant}:{mbti}")
+    return "\n".join(decoded)
+
+
+def estimate_compact_message_tokens(messages):
+    # Per-message cost in the compact format, charging every message its own
+    # aliased line; merging only ever makes the real prompt a little smaller
+    return [estimate_tokens(f"A: {compact_text(message)}\n") for _, message in messages]
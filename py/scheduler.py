@@ -0,0 +1,219 @@
+import asyncio
+import contextvars
+import heapq
+import itertools
+import logging
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+
+import aiohttp
+
+import instrument
+
+logger = logging.getLogger(__name__)
+
+API_BASE = os.getenv("OPENAI_API_BASE", "https://api.openai.com/v1")
+MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_RPM", "500"))
+TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TPM", "200000"))
+MAX_RETRIES = 8
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+RETRY_STATUSES = {408, 409, 429, 500, 502, 503, 504}
+
+# Priority of the requests made from the current task and the tasks it starts;
+# higher goes first when requests queue for a slot. Set per job by jobs.JobRunner.
+request_priority = contextvars.ContextVar("request_priority", default=0)
+
+
+class RetriesExhausted(Exception):
+    pass
+
+
+class RateLimiter:
+    # Token bucket refilled continuously at per_minute / 60 units a second
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        # A single request bigger than the whole budget still goes through, it just drains the bucket
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                await asyncio.sleep((amount - self.level) / self.rate)
+
+
+class PriorityGate:
+    # Semaphore that hands free slots to the highest-priority waiter, oldest first
+    # among equals, instead of whichever task happened to ask first
+
+    def __init__(self, slots):
+        self.free = slots
+        self.waiters = []
+        self.order = itertools.count()
+
+    async def acquire(self, priority=0):
+        if self.free > 0 and not self.waiters:
+            self.free -= 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (-priority, next(self.order), waiter))
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Handed a slot just as we were cancelled; pass it on
+                self.release()
+            else:
+                self._drop(waiter)
+            raise
+
+    def _drop(self, waiter):
+        self.waiters = [entry for entry in self.waiters if entry[2] is not waiter]
+        heapq.heapify(self.waiters)
+
+    def release(self):
+        while self.waiters:
+            _, _, waiter = heapq.heappop(self.waiters)
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.free += 1
+
+
+def retry_after_seconds(headers):
+    value = headers.get("Retry-After")
+    if value is None:
+        # OpenAI also sends reset hints in milliseconds
+        value = headers.get("retry-after-ms")
+        return float(value) / 1000 if value else None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def backoff_delay(attempt, base=BASE_DELAY, cap=MAX_DELAY):
+    # Full jitter: spreads retries out so throttled requests don't come back in lockstep
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def make_session(max_concurrency=MAX_CONCURRENCY):
+    connector = aiohttp.TCPConnector(
+        limit=max_concurrency,
+        limit_per_host=max_concurrency,
+        ttl_dns_cache=300,
+        keepalive_timeout=60,
+    )
+    timeout = aiohttp.ClientTimeout(total=180, sock_connect=10)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+class RequestScheduler:
+    def __init__(self, api_key=None, base_url=API_BASE, max_concurrency=MAX_CONCURRENCY,
+                 requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 max_retries=MAX_RETRIES, session=None):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.gate = PriorityGate(max_concurrency)
+        self.requests = RateLimiter(requests_per_minute)
+        self.tokens = RateLimiter(tokens_per_minute)
+        self.session = session
+        self._owns_session = session is None
+        self._users = 0
+        # Set from Retry-After so every caller backs off together, not just the one that got the 429
+        self.paused_until = 0.0
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "failures": 0}
+
+    async def __aenter__(self):
+        # Re-entrant so one scheduler can be shared by several concurrent runs
+        self._users += 1
+        if self.session is None:
+            self.session = make_session(self.max_concurrency)
+        return self
+
+    async def __aexit__(self, *exc):
+        self._users -= 1
+        if self._users == 0 and self._owns_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _wait_for_pause(self):
+        delay = self.paused_until - time.monotonic()
+        while delay > 0:
+            await asyncio.sleep(delay)
+            delay = self.paused_until - time.monotonic()
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    async def post(self, url, payload, tokens=1, headers=None):
+        headers = dict(headers or {})
+        if self.api_key:
+            headers.setdefault("Authorization", f"Bearer {self.api_key}")
+
+        priority = request_priority.get()
+        for attempt in range(self.max_retries + 1):
+            # The slot is taken before the rate limits, so when the budget is the
+            # bottleneck it's the highest-priority requests that wait at the front
+            await self.gate.acquire(priority)
+            try:
+                await self._wait_for_pause()
+                await self.requests.acquire(1)
+                await self.tokens.acquire(tokens)
+                self.stats["requests"] += 1
+                instrument.count("api_requests")
+                request_start = time.perf_counter()
+                try:
+                    async with self.session.post(url, json=payload, headers=headers) as response:
+                        instrument.observe("api_request_seconds", time.perf_counter() - request_start)
+                        if response.status not in RETRY_STATUSES:
+                            return await response.json(content_type=None)
+                        retry_after = retry_after_seconds(response.headers)
+                        reason = f"HTTP {response.status}"
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    retry_after = None
+                    reason = f"{type(e).__name__}: {e}"
+            finally:
+                self.gate.release()
+
+            if reason == "HTTP 429":
+                self.stats["throttled"] += 1
+                instrument.count("api_throttled")
+            if attempt == self.max_retries:
+                break
+            if retry_after is not None:
+                delay = retry_after + random.uniform(0, BASE_DELAY)
+                self.pause(delay)
+            else:
+                delay = backoff_delay(attempt)
+            self.stats["retries"] += 1
+            instrument.count("api_retries")
+            logger.debug(f"Retrying {url} in {delay:.2f}s after {reason} (attempt {attempt + 1}/{self.max_retries})")
+            await asyncio.sleep(delay)
+
+        self.stats["failures"] += 1
+        instrument.count("api_failures")
+        raise RetriesExhausted(f"{reason} after {self.max_retries} retries")
+
+    async def chat_completion(self, payload, tokens=1):
+        return await self.post(f"{self.base_url}/chat/completions", payload, tokens)
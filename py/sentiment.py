@@ -0,0 +1,292 @@
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import re
+
+import numpy as np
+
+import instrument
+from analytics_index import DAY, week_starts
+from parsers.store import from_epoch, parse_columnar
+from parsers.tokenization import SEPARATOR, tokenize_many
+
+logger = logging.getLogger(__name__)
+
+# Offline sentiment scoring for chat messages, on the frontend's -10..10 scale.
+# Messages are tokenized as one batch and every token mapped to a word code in
+# one pass, so the lexicon lookups, negation and booster rules and per-message
+# sums are all array operations over the batch. Scores follow VADER's shape:
+# word valences of -4..4, flipped and damped after a negator, pushed up after a
+# booster, and the message sum squashed into -1..1 (here scaled to -10..10).
+#
+# Messages the lexicon has little to say about can optionally be re-scored by
+# the LLM in numbered batches (refine_scores), through the shared scheduler.
+
+LEXICON_TEXT = """
+4: love loved loving adore adored amazing awesome fantastic incredible perfect wonderful excellent brilliant
+   outstanding superb ecstatic thrilled overjoyed best emojilove emojihearteyes
+3: great happy glad beautiful gorgeous delighted excited exciting fun funny hilarious lovely sweet cute yay
+   congrats congratulations thank thanks grateful proud enjoy enjoyed enjoying wow blessed stoked
+   emojilaugh emojismile
+2: good nice cool fine like likes liked pleased hope hoping kind friendly yum yummy tasty interesting
+   haha hahaha lol lmao xd miss relaxed calm safe smart win won winning emojithumbsup emojiwink
+1: ok okay alright sure fair decent better chill interested laugh agree easy
+-1: meh tired busy late weird odd confused unsure doubt boring bored hard difficult slow cold sick
+-2: bad sad sorry upset worried worry annoying annoyed problem problems wrong fail failed failing lost
+   lose losing hurt hurts pain painful stress stressed stressful scared afraid nervous lonely ugh
+   emojisad emojicry
+-3: angry mad terrible awful horrible hate hated hates disappointed disappointing depressed miserable
+   disgusting gross stupid idiot sucks crap pissed furious emojiangry
+-4: worst disaster devastated heartbroken kill dead die dying abuse
+"""
+NEGATORS = frozenset("""
+not no never none nothing nobody nowhere neither nor without cant cannot dont doesnt didnt isnt arent wasnt
+werent wont wouldnt shouldnt couldnt havent hasnt hadnt aint nope
+""".split())
+BOOSTERS = frozenset("""
+very really so super extremely totally absolutely incredibly such too soo sooo most quite completely
+""".split())
+# VADER's constants: negated valences are flipped and scaled by -0.74, boosters add 0.293,
+# and a sum s maps to s / sqrt(s^2 + 15)
+NEGATION_SCALE = -0.74
+BOOST = 0.293
+NORMALIZATION = 15.0
+# A negator affects the next three words
+NEGATION_WINDOW = 3
+
+# Emoji and emoticons, rewritten as lexicon words before tokenizing strips them
+EMOTICONS = {
+    "\u2764": "emojilove", "\u2665": "emojilove", "\U0001F60D": "emojihearteyes", "\U0001F970": "emojihearteyes",
+    "\U0001F618": "emojilove", "\U0001F602": "emojilaugh", "\U0001F923": "emojilaugh", "\U0001F60A": "emojismile",
+    "\U0001F642": "emojismile", "\U0001F600": "emojismile", "\U0001F601": "emojismile", "\U0001F604": "emojismile",
+    "\U0001F44D": "emojithumbsup", "\U0001F609": "emojiwink", "\U0001F622": "emojicry", "\U0001F62D": "emojicry",
+    "\U0001F61E": "emojisad", "\u2639": "emojisad", "\U0001F641": "emojisad", "\U0001F621": "emojiangry", "\U0001F620": "emojiangry",
+    "<3": "emojilove", ":-)": "emojismile", ":)": "emojismile", ":D": "emojilaugh", ";)": "emojiwink",
+    ":-(": "emojisad", ":(": "emojisad", ":'(": "emojicry",
+}
+_EMOTICON_WORDS = {emoticon: f" {word} " for emoticon, word in EMOTICONS.items()}
+# A code point range covering all the emoji above, which re scans much faster than a set
+# of single characters; whatever it matches that isn't in EMOTICONS is left alone
+_EMOTICON = re.compile("[\u2639\u2665\u2764\U0001F44D-\U0001F970]|[<:;](?:3|-?[()D]|'\\()")
+
+# Refinement candidates: at least one lexicon word, at least this many words, and confidence below the threshold
+REFINE_MIN_WORDS = 4
+REFINE_THRESHOLD = 0.35
+REFINE_BATCH = 50
+REFINE_MAX_CHARS = 400
+REFINE_MODEL = "gpt-4o-mini"
+REFINE_HEADER = ("Rate the sentiment of each numbered chat message from -10 (extremely negative) to 10 "
+                 "(extremely positive), 0 being neutral. Reply with only one line per message, number then score, "
+                 "like \"3: -2\".\n\n")
+_RATING = re.compile(r"^\s*(\d+)\s*[:.)-]\s*(-?\d+(?:\.\d+)?)", re.MULTILINE)
+
+
+def parse_lexicon(text):
+    lexicon = {}
+    valence = None
+    for line in text.strip().splitlines():
+        head, colon, words = line.partition(":")
+        if colon and head.strip().lstrip("-").isdigit():
+            valence = float(head)
+        else:
+            words = line
+        for word in words.split():
+            lexicon[word] = valence
+    return lexicon
+
+
+LEXICON = parse_lexicon(LEXICON_TEXT)
+
+
+def _emoticon_word(match):
+    return _EMOTICON_WORDS.get(match.group(), match.group())
+
+
+def replace_emoticons(texts):
+    parts = _EMOTICON.sub(_emoticon_word, SEPARATOR.join(texts)).split(SEPARATOR)
+    if len(parts) != len(texts):
+        # A message contained the separator itself
+        return [_EMOTICON.sub(_emoticon_word, text) for text in texts]
+    return parts
+
+
+class SentimentScorer:
+    # Every word the rules care about gets a small integer code (0 for the rest),
+    # looked up for the whole batch in one C-level map; valences and the negator
+    # and booster flags are then plain array indexing by code
+
+    def __init__(self, lexicon=None, negators=NEGATORS, boosters=BOOSTERS):
+        lexicon = LEXICON if lexicon is None else lexicon
+        words = sorted(set(lexicon) | set(negators) | set(boosters))
+        self.codes = {word: code for code, word in enumerate(words, 1)}
+        self.valences = np.array([0.0] + [lexicon.get(word, 0.0) for word in words])
+        self.is_negator = np.array([False] + [word in negators for word in words])
+        self.is_booster = np.array([False] + [word in boosters for word in words])
+
+    def token_codes(self, texts):
+        # (flat word codes, words per message)
+        tokens = tokenize_many(replace_emoticons(texts))
+        lengths = np.fromiter(map(len, tokens), dtype=np.int64, count=len(tokens))
+        flat = itertools.chain.from_iterable(tokens)
+        codes = np.fromiter(map(self.codes.get, flat, itertools.repeat(0)), dtype=np.int32, count=int(lengths.sum()))
+        return codes, lengths
+
+    @instrument.traced("sentiment.score")
+    def score(self, texts):
+        # (scores on -10..10, confidence in 0..1, words, lexicon hits) per message
+        codes, lengths = self.token_codes(texts)
+        message_count = len(lengths)
+        owners = np.repeat(np.arange(message_count), lengths)
+        # Position of each token within its message, so rules never reach into the previous one
+        positions = np.arange(len(codes)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        valence = self.valences[codes]
+        negator = self.is_negator[codes]
+        negated = np.zeros(len(codes), dtype=bool)
+        for distance in range(1, NEGATION_WINDOW + 1):
+            negated[distance:] |= negator[:-distance] & (positions[distance:] >= distance)
+        boosted = np.zeros(len(codes), dtype=bool)
+        boosted[1:] = self.is_booster[codes[:-1]] & (positions[1:] >= 1)
+
+        valence = valence + np.sign(valence) * BOOST * boosted
+        valence = np.where(negated, valence * NEGATION_SCALE, valence)
+
+        total = np.bincount(owners, weights=valence, minlength=message_count)
+        positive = np.bincount(owners, weights=np.clip(valence, 0, None), minlength=message_count)
+        negative = -np.bincount(owners, weights=np.clip(valence, None, 0), minlength=message_count)
+        hits = np.bincount(owners, weights=valence != 0, minlength=message_count)
+
+        scores = 10 * total / np.sqrt(total * total + NORMALIZATION)
+        # More sentiment words, all pulling the same way, is more certain
+        magnitude = positive + negative
+        agreement = np.divide(np.abs(positive - negative), magnitude, out=np.zeros(message_count), where=magnitude > 0)
+        confidence = (1 - np.exp(-hits)) * agreement
+        instrument.count("sentiment_messages", message_count)
+        return scores, confidence, lengths, hits.astype(np.int64)
+
+
+def score_messages(texts, lexicon=None):
+    return SentimentScorer(lexicon).score(list(texts))
+
+
+def refinement_candidates(confidence, words, hits, threshold=REFINE_THRESHOLD, min_words=REFINE_MIN_WORDS):
+    # Messages the lexicon found sentiment in but can't settle (one weak word, or words
+    # pulling both ways). Messages without any lexicon word are left neutral: in chat
+    # that's mostly logistics, and sending them would mean re-scoring half the chat.
+    return np.flatnonzero((confidence < threshold) & (words >= min_words) & (hits > 0))
+
+
+def refine_prompt(texts):
+    lines = [f"{number}. {' '.join(text.split())[:REFINE_MAX_CHARS]}\n" for number, text in enumerate(texts, 1)]
+    return "".join([REFINE_HEADER, *lines])
+
+
+def parse_ratings(reply, count):
+    # {index in batch: score} for the lines that parse and are in range
+    ratings = {}
+    for number, score in _RATING.findall(reply):
+        index = int(number) - 1
+        if 0 <= index < count:
+            ratings[index] = min(10.0, max(-10.0, float(score)))
+    return ratings
+
+
+async def refine_scores(texts, scores, candidates, scheduler, cache=None, batch_size=REFINE_BATCH):
+    # Re-score texts[candidates] with the LLM, REFINE_BATCH messages per request; scores is updated in place.
+    # Returns how many messages got an LLM score.
+    from llm_cache import cache_key
+    from tokens import estimate_tokens
+
+    async def refine_batch(batch):
+        prompt = refine_prompt([texts[index] for index in batch])
+        key = cache_key(REFINE_MODEL, 0, prompt)
+        reply = cache.get(key) if cache is not None else None
+        if reply is None:
+            try:
+                result = await scheduler.chat_completion({
+                    "model": REFINE_MODEL,
+                    "messages": [{"role": "user", "content": prompt}],
+                    "temperature": 0,
+                }, tokens=estimate_tokens(prompt) + 4 * len(batch))
+                reply = result["choices"][0]["message"]["content"]
+            except Exception as e:
+                logger.error(f"Sentiment refinement request failed: {e}")
+                return 0
+            if cache is not None:
+                cache.put(key, reply, REFINE_MODEL)
+        ratings = parse_ratings(reply, len(batch))
+        for position, score in ratings.items():
+            scores[batch[position]] = score
+        return len(ratings)
+
+    batches = [candidates[i:i + batch_size].tolist() for i in range(0, len(candidates), batch_size)]
+    async with scheduler:
+        refined = sum(await asyncio.gather(*(refine_batch(batch) for batch in batches)))
+    instrument.count("sentiment_refined", refined)
+    logger.info(f"Refined {refined} of {len(candidates)} low-confidence messages in {len(batches)} requests")
+    return refined
+
+
+def weekly_series(store, scores, week_start=6):
+    # {user: [{"week": "yyyy-MM-dd", "sentiment": mean score, "messages": n}, ...]} for the weeks each user wrote in.
+    # Weeks start on Sunday by default, like date-fns startOfWeek.
+    if not len(store):
+        return {user: [] for user in store.users}
+    weeks = week_starts(store.timestamps, week_start)
+    first = int(weeks.min())
+    week_index = (weeks - first) // (7 * DAY)
+    user_count = len(store.users)
+    keys = week_index * user_count + store.user_ids
+    size = (int(week_index.max()) + 1) * user_count
+    totals = np.bincount(keys, weights=scores, minlength=size).reshape(-1, user_count)
+    counts = np.bincount(keys, minlength=size).reshape(-1, user_count)
+
+    series = {}
+    for user_id, user in enumerate(store.users):
+        active = np.flatnonzero(counts[:, user_id])
+        series[user] = [
+            {"week": from_epoch(first + int(week) * 7 * DAY).strftime("%Y-%m-%d"),
+             "sentiment": round(float(totals[week, user_id] / counts[week, user_id]), 2),
+             "messages": int(counts[week, user_id])}
+            for week in active
+        ]
+    return series
+
+
+async def analyse_file(chat_file, pattern=None, refine=False, scheduler=None, cache_path=None):
+    store = parse_columnar(chat_file, pattern)
+    texts = list(store.texts())
+    scores, confidence, words, hits = score_messages(texts)
+    if refine:
+        candidates = refinement_candidates(confidence, words, hits)
+        if scheduler is None:
+            from personality import openai_api_key
+            from scheduler import RequestScheduler
+            scheduler = RequestScheduler(api_key=openai_api_key)
+        cache = None
+        if cache_path:
+            from llm_cache import LLMCache
+            cache = LLMCache(cache_path)
+        try:
+            await refine_scores(texts, scores, candidates, scheduler, cache)
+        finally:
+            if cache is not None:
+                cache.close()
+    return {"users": list(store.users), "series": weekly_series(store, scores)}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    arg_parser = argparse.ArgumentParser(description="Weekly per-user sentiment series for the frontend charts")
+    arg_parser.add_argument("chat_file")
+    arg_parser.add_argument("output", help="output JSON")
+    arg_parser.add_argument("--pattern", default=None, help="regex with timestamp/user/message groups (default: detect)")
+    arg_parser.add_argument("--refine", action="store_true", help="re-score low-confidence messages with the LLM")
+    arg_parser.add_argument("--cache", default=None, help="LLM response cache for --refine")
+    args = arg_parser.parse_args()
+
+    result = asyncio.run(analyse_file(args.chat_file, args.pattern, refine=args.refine, cache_path=args.cache))
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False)
@@ -0,0 +1,22 @@
+import re
+
+# Offline token estimate for GPT-style BPE vocabularies, no tokenizer download
+# needed. Short words and single punctuation marks are one token each, longer
+# words are charged one token per extra ~6 characters and digits go in groups of
+# three. Rough, but stable, which is what chunk budgeting needs.
+_PIECE = re.compile(r"[^\W\d_]+|\d{1,3}|[^\w\s]|_+")
+_LONG_WORD = re.compile(r"[^\W\d_]{7,}")
+
+
+def estimate_tokens(text):
+    if not text:
+        return 0
+    extra = 0
+    for word in _LONG_WORD.findall(text):
+        extra += (len(word) - 1) // 6
+    return len(_PIECE.findall(text)) + extra
+
+
+def estimate_message_tokens(messages):
+    # Per-line cost of each (sender, message) pair as create_prompt formats it
+    return [estimate_tokens(f"{sender}: {message}\n") for sender, message in messages]
@@ -0,0 +1,87 @@
+import numpy as np
+from scipy import sparse
+
+# Distinctive-word scoring over a sparse user x vocabulary count matrix. All
+# users are scored at once with array operations, so cost grows with the number
+# of distinct (user, word) pairs rather than users^2 x vocabulary.
+
+
+class UserWordCounts:
+    def __init__(self, users, vocabulary, counts):
+        self.users = users
+        self.vocabulary = vocabulary
+        # scipy CSR matrix, counts[u, w] = times users[u] used vocabulary[w]
+        self.counts = counts
+
+    @classmethod
+    def from_tokens(cls, user_tokens):
+        # user_tokens yields (user, tokens) per message, built in one pass
+        user_index = {}
+        vocab_index = {}
+        message_users = []
+        lengths = []
+        columns = []
+        for user, tokens in user_tokens:
+            message_users.append(user_index.setdefault(user, len(user_index)))
+            lengths.append(len(tokens))
+            columns.extend([vocab_index.setdefault(token, len(vocab_index)) for token in tokens])
+
+        rows = np.repeat(np.asarray(message_users, dtype=np.int32), np.asarray(lengths, dtype=np.int64))
+        columns = np.asarray(columns, dtype=np.int32)
+        counts = sparse.coo_matrix(
+            (np.ones(len(columns), dtype=np.int64), (rows, columns)),
+            shape=(len(user_index), len(vocab_index)),
+        ).tocsr()
+        counts.sum_duplicates()
+        return cls(list(user_index), list(vocab_index), counts)
+
+    def user_totals(self):
+        return np.asarray(self.counts.sum(axis=1)).ravel()
+
+    def _others(self):
+        # For every stored (user, word) entry: how often everyone else used the word
+        word_totals = np.asarray(self.counts.sum(axis=0)).ravel()
+        return word_totals[self.counts.indices] - self.counts.data
+
+    def ratios(self):
+        # (count + 1) / (everyone else's count + 1) for every word a user used
+        scores = (self.counts.data + 1) / (self._others() + 1)
+        return self._with_data(scores)
+
+    def log_odds(self, prior=0.01):
+        # Log-odds ratio with an informative Dirichlet prior (Monroe et al., 2008),
+        # as z-scores. Less swayed by rare words than plain ratios.
+        word_totals = np.asarray(self.counts.sum(axis=0)).ravel().astype(np.float64)
+        alpha = prior * word_totals + 1e-9
+        alpha_total = alpha.sum()
+        user_totals = self.user_totals().astype(np.float64)
+        grand_total = user_totals.sum()
+
+        rows = np.repeat(np.arange(len(self.users)), np.diff(self.counts.indptr))
+        a = alpha[self.counts.indices]
+        mine = self.counts.data.astype(np.float64)
+        others = self._others().astype(np.float64)
+        n_mine = user_totals[rows]
+        n_others = grand_total - n_mine
+
+        delta = (np.log((mine + a) / (n_mine + alpha_total - mine - a))
+                 - np.log((others + a) / (n_others + alpha_total - others - a)))
+        variance = 1 / (mine + a) + 1 / (others + a)
+        return self._with_data(delta / np.sqrt(variance))
+
+    def _with_data(self, data):
+        return sparse.csr_matrix((data, self.counts.indices, self.counts.indptr), shape=self.counts.shape)
+
+    def top_k(self, scores, k=None):
+        # {user: {word: score}} with each user's k highest scores, best first
+        result = {}
+        for row, user in enumerate(self.users):
+            lo, hi = scores.indptr[row], scores.indptr[row + 1]
+            data = scores.data[lo:hi]
+            columns = scores.indices[lo:hi]
+            if k is not None and k < len(data):
+                keep = np.argpartition(-data, k)[:k]
+                data, columns = data[keep], columns[keep]
+            order = np.argsort(-data, kind="stable")
+            result[user] = {self.vocabulary[column]: float(score) for column, score in zip(columns[order].tolist(), data[order].tolist())}
+        return result